@@ -19,7 +19,7 @@ worker = window.Worker.new("runner.js", type="module")
 class GetChallengeResponse(TypedDict):
     """Response schema for /get_challenge endpoint."""
 
-    question: str
+    image_url: str
     tasks: list[int]
 
 
@@ -57,11 +57,12 @@ def get_challenge_id() -> str:
     return challenge_id
 
 
-async def get_challenge() -> tuple[bytes, list[int]]:
+async def get_challenge() -> tuple[str | bytes, list[int]]:
     """Endpoint to collect challenge data.
 
     Returns:
-        tuple[str, list[int]]: The question string and the associated task list.
+        tuple[str | bytes, list[int]]: The absolute URL of the question image, or an error image,
+            and the associated task list.
 
     """
     challenge_id = get_challenge_id()
@@ -72,7 +73,8 @@ async def get_challenge() -> tuple[bytes, list[int]]:
         )
         return (error_image, [1])
     response: GetChallengeResponse = await request.json()
-    return (b64decode(response["question"]), response["tasks"])
+    # absolute, so the image pane lets the browser load it and cache it instead of embedding it
+    return (urllib.parse.urljoin(window.location.href, response["image_url"]), response["tasks"])
 
 
 def _to_int(x: str) -> int:
@@ -197,9 +199,11 @@ initial_verify = pn.widgets.Button(
     visible=False,
     align=("end", "center"),
 )
+# the server renders at the width bucket below the requested width, the image is scaled to fill the container
 question = pn.pane.image.PNG(
     b64decode("iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAQAAAC1HAwCAAAAC0lEQVR42mNkYAAAAAYAAjCB0C8AAAAASUVORK5CYII="),
     sizing_mode="stretch_width",
+    fixed_aspect=True,
 )
 initial_loading = pn.indicators.LoadingSpinner(
     size=20,
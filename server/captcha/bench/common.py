@@ -0,0 +1,36 @@
+"""The question set and number theory tables arguments shared by the benchmarks."""
+
+import argparse
+from pathlib import Path
+
+from msgspec.json import decode
+from server.captcha.lib.number_theory import ensure_table, required_limit
+from server.captcha.schema.questions import QuestionSet
+
+DEFAULT_QUESTION_SET = Path("./captcha_data/question_set.json")
+DEFAULT_TABLE_DIRECTORY = Path("./captcha_data/number_theory")
+
+
+def add_question_set_arguments(parser: argparse.ArgumentParser, *, table: bool = True) -> None:
+    """Add `--question-set`, and `--table-directory` unless `table` is `False`, to the parser."""
+    parser.add_argument("--question-set", type=Path, default=DEFAULT_QUESTION_SET)
+    if table:
+        parser.add_argument(
+            "--table-directory",
+            type=Path,
+            default=DEFAULT_TABLE_DIRECTORY,
+            help="Number theory tables to measure with, built if they do not cover the question set",
+        )
+
+
+def load_question_set(path: Path, table_directory: Path | None = None) -> QuestionSet:
+    """Decode the question set, and load the number theory tables in `table_directory` for it if given.
+
+    Returns:
+        QuestionSet: The question set.
+
+    """
+    question_set = decode(path.read_bytes(), type=QuestionSet)
+    if table_directory is not None:
+        ensure_table(table_directory, required_limit(question_set))
+    return question_set
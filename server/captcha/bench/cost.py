@@ -0,0 +1,175 @@
+"""Profile the cost of every `base` and `part` of a question set over samples of its declared domains.
+
+Run with `uv run python -m server.captcha.bench.cost`.
+"""
+
+import argparse
+import os
+import statistics
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from random import Random
+from typing import Literal
+
+from msgspec import Struct
+from msgspec.json import encode, format
+from server.captcha.bench.common import add_question_set_arguments, load_question_set
+from server.captcha.lib.metrics import percentile
+from server.captcha.lib.number_theory import load_table
+from server.captcha.lib.utils import fill_question
+from server.captcha.lib.validator import compile_validator
+from server.captcha.schema.questions import Part, Question, QuestionSet
+
+# `part` has no declared input, it is applied to the answer of the previous step
+DEFAULT_PART_INPUT = (1, 65536)
+SORT_KEYS = ("p50", "p90", "p99", "max", "bits", "errors")
+
+type EntryKind = Literal["base", "part"]
+
+
+class EntryCost(Struct):
+    """The measured cost of one `base` or `part` entry."""
+
+    kind: EntryKind
+    index: int
+    validator: str
+    samples: int
+    p50: float
+    p90: float
+    p99: float
+    max: float
+    bits: int
+    errors: float
+    error_types: dict[str, int]
+
+
+def profile_entry(
+    kind: EntryKind,
+    index: int,
+    entry: Part,
+    samples: int,
+    seed: int,
+) -> EntryCost:
+    """Time the validator of an entry on `samples` random values and inputs.
+
+    Returns:
+        EntryCost: The timing percentiles in microseconds, peak result bit length and exception rate of the entry.
+
+    """
+    random_obj = Random(seed)  # noqa: S311 profile need to be reproducible
+    factory = compile_validator(entry.validator)
+    value_range = entry.input if isinstance(entry, Question) else DEFAULT_PART_INPUT
+    times: list[float] = []
+    bits = 0
+    error_types: Counter[str] = Counter()
+    for _ in range(samples):
+        section = fill_question(entry, random_obj)
+        fn = factory.bind(section.values)
+        x = random_obj.randint(*value_range)
+        start = time.perf_counter()
+        try:
+            result = fn(x)
+        except Exception as e:  # noqa: BLE001 exceptions are counted in the report
+            times.append(time.perf_counter() - start)
+            error_types[type(e).__name__] += 1
+            continue
+        times.append(time.perf_counter() - start)
+        bits = max(bits, int(result).bit_length())
+    times.sort()
+    return EntryCost(
+        kind=kind,
+        index=index,
+        validator=entry.validator,
+        samples=samples,
+        p50=percentile(times, 0.5) * 1e6,
+        p90=percentile(times, 0.9) * 1e6,
+        p99=percentile(times, 0.99) * 1e6,
+        max=times[-1] * 1e6 if times else 0.0,
+        bits=bits,
+        errors=error_types.total() / samples if samples else 0.0,
+        error_types=dict(error_types.most_common()),
+    )
+
+
+def profile_question_set(
+    question_set: QuestionSet,
+    samples: int,
+    seed: int = 0,
+    workers: int | None = None,
+    table_directory: Path | None = None,
+) -> list[EntryCost]:
+    """Profile every `base` and `part` of the question set, spread across `workers` processes.
+
+    The helpers use the number theory tables in `table_directory` if given, as the server does.
+
+    Returns:
+        list[EntryCost]: The cost of each entry, in the order of the question set.
+
+    """
+    jobs: list[tuple[EntryKind, int, Part]] = [
+        *(("base", i, entry) for i, entry in enumerate(question_set.base)),
+        *(("part", i, entry) for i, entry in enumerate(question_set.part)),
+    ]
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=None if table_directory is None else load_table,
+        initargs=() if table_directory is None else (table_directory,),
+    ) as executor:
+        futures = [
+            executor.submit(profile_entry, kind, index, entry, samples, seed + offset)
+            for offset, (kind, index, entry) in enumerate(jobs)
+        ]
+        return [future.result() for future in futures]
+
+
+def format_table(costs: list[EntryCost]) -> str:
+    """Format the costs as a plain text table.
+
+    Returns:
+        str: The table.
+
+    """
+    lines = [
+        f"{'entry':<10}{'p50 (us)':>10}{'p90 (us)':>10}{'p99 (us)':>10}{'max (us)':>11}{'bits':>7}{'errors':>8}"
+        "  validator",
+    ]
+    lines.extend(
+        f"{cost.kind}[{cost.index}]".ljust(10)
+        + f"{cost.p50:>10.2f}{cost.p90:>10.2f}{cost.p99:>10.2f}{cost.max:>11.2f}{cost.bits:>7}{cost.errors:>8.1%}"
+        + f"  {cost.validator}"
+        for cost in costs
+    )
+    return "\n".join(lines)
+
+
+def main() -> None:  # noqa: D103
+    parser = argparse.ArgumentParser(description=__doc__)
+    add_question_set_arguments(parser)
+    parser.add_argument("--samples", type=int, default=2000, help="Number of filled validator per entry")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of processes")
+    parser.add_argument("--sort", choices=SORT_KEYS, default="p99", help="Sort the entries by this column, descending")
+    parser.add_argument("--json", type=Path, help="Also write the report as JSON to this path")
+    parser.add_argument("--no-table", action="store_true", help="Measure the helpers falling back to sympy")
+    args = parser.parse_args()
+
+    table_directory = None if args.no_table else args.table_directory
+    question_set = load_question_set(args.question_set, table_directory)
+    start = time.perf_counter()
+    costs = profile_question_set(question_set, args.samples, args.seed, args.workers, table_directory)
+    elapsed = time.perf_counter() - start
+    costs.sort(key=lambda cost: getattr(cost, args.sort), reverse=True)
+
+    print(format_table(costs))
+    print(
+        f"\n{len(costs)} entries, {args.samples} samples each, {elapsed:.2f}s on {args.workers} processes"
+        f"\nmedian p99: {statistics.median(cost.p99 for cost in costs):.2f}us",
+    )
+    if args.json is not None:
+        args.json.write_bytes(format(encode(costs)))
+
+
+if __name__ == "__main__":
+    main()
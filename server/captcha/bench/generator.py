@@ -0,0 +1,214 @@
+"""Benchmark `question_generator` by construct, and `fill_question` with the validator of every `base` and `part`.
+
+Every case runs on fixed seeds, and is compared against the stored baseline, exiting with 1 on a regression.
+Run with `uv run python -m server.captcha.bench.generator`, add `--update` to store the results as the baseline.
+The baseline is only comparable on the machine it was measured on, so it is not committed: the first run stores it.
+"""
+
+import argparse
+import gc
+import logging
+import sys
+import time
+import tracemalloc
+from collections.abc import Callable
+from pathlib import Path
+from random import Random
+
+from msgspec import Struct
+from msgspec.json import decode, encode, format
+from msgspec.structs import replace
+from server.captcha.bench.common import add_question_set_arguments, load_question_set
+from server.captcha.lib.metrics import percentile
+from server.captcha.lib.utils import TASK_AMOUNT, fill_question, question_generator
+from server.captcha.lib.validator import compile_validator
+from server.captcha.schema.questions import Part, Question, QuestionSet
+
+DEFAULT_BASELINE = Path(__file__).with_name("generator_baseline.json")
+# `part` has no declared input, it is applied to the answer of the previous step
+DEFAULT_PART_INPUT = (1, 65536)
+
+type Case = Callable[[int], object]
+
+
+class BenchResult(Struct):
+    """The timing in microseconds and the allocations of one benchmark case."""
+
+    samples: int
+    throughput: float
+    p50: float
+    p90: float
+    p99: float
+    peak_bytes: float
+    retained_blocks: float
+
+
+def _time(case: Case, samples: int, seed: int) -> list[float]:
+    times: list[float] = []
+    # as `timeit`, the garbage collector would add the pauses of unrelated objects to a random call
+    gc.disable()
+    try:
+        for offset in range(samples):
+            start = time.perf_counter()
+            case(seed + offset)
+            times.append(time.perf_counter() - start)
+    finally:
+        gc.enable()
+    return sorted(times)
+
+
+def run_case(case: Case, samples: int, seed: int, repeat: int = 3) -> BenchResult:
+    """Time `case` on the seeds from `seed`, then run it again under tracemalloc for its allocations.
+
+    The timing is repeated `repeat` times and the round with the lowest median is kept, as noise only adds time.
+
+    Returns:
+        BenchResult: The throughput per second, timing percentiles, mean peak of traced memory of a call,
+            and the blocks still allocated after a call on average.
+
+    """
+    times = min((_time(case, samples, seed) for _ in range(max(1, repeat))), key=lambda times: times[len(times) // 2])
+
+    # traced separately, as tracing slows down every allocation
+    peak_total = 0
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        for offset in range(samples):
+            tracemalloc.reset_peak()
+            current, _ = tracemalloc.get_traced_memory()
+            case(seed + offset)
+            peak_total += tracemalloc.get_traced_memory()[1] - current
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    retained = sum(stat.count_diff for stat in after.compare_to(before, "filename"))
+
+    return BenchResult(
+        samples=samples,
+        throughput=samples / sum(times),
+        p50=percentile(times, 0.5) * 1e6,
+        p90=percentile(times, 0.9) * 1e6,
+        p99=percentile(times, 0.99) * 1e6,
+        peak_bytes=peak_total / samples,
+        retained_blocks=retained / samples,
+    )
+
+
+def construct_case(question_set: QuestionSet, construct: str) -> Case:
+    """Generate a question of a single construct shape.
+
+    Returns:
+        Case: The case, taking the seed of the question.
+
+    """
+    single = replace(question_set, construct=[construct])
+    return lambda seed: question_generator(single, seed=seed)
+
+
+def entry_case(entry: Question | Part) -> Case:
+    """Fill a `base` or `part`, and run its validator on the largest amount of tasks.
+
+    Returns:
+        Case: The case, taking the seed of the values and tasks.
+
+    """
+    factory = compile_validator(entry.validator)
+    value_range = entry.input if isinstance(entry, Question) else DEFAULT_PART_INPUT
+
+    def case(seed: int) -> object:
+        random_obj = Random(seed)  # noqa: S311 benchmark need to be reproducible
+        section = fill_question(entry, random_obj)
+        fn = factory.bind(section.values)
+        try:
+            return [fn(random_obj.randint(*value_range)) for _ in range(TASK_AMOUNT[1])]
+        except Exception as e:  # noqa: BLE001 the entries raising on some input are still measured
+            return e
+
+    return case
+
+
+def cases(question_set: QuestionSet) -> dict[str, Case]:
+    """Get every benchmark case of the question set by name.
+
+    Returns:
+        dict[str, Case]: The cases, the whole generator, each construct, then each `base` and `part`.
+
+    """
+    return {
+        "generator": lambda seed: question_generator(question_set, seed=seed),
+        **{f"construct[{i}]": construct_case(question_set, c) for i, c in enumerate(question_set.construct)},
+        **{f"base[{i}]": entry_case(entry) for i, entry in enumerate(question_set.base)},
+        **{f"part[{i}]": entry_case(entry) for i, entry in enumerate(question_set.part)},
+    }
+
+
+def regressions(
+    results: dict[str, BenchResult],
+    baseline: dict[str, BenchResult],
+    tolerance: float,
+) -> list[str]:
+    """Compare the p50 and the peak memory of every case present in both against the baseline.
+
+    Returns:
+        list[str]: A description of each regression beyond `tolerance`, as a fraction of the baseline.
+
+    """
+    found: list[str] = []
+    for name, result in results.items():
+        if (base := baseline.get(name)) is None:
+            continue
+        if result.p50 > base.p50 * (1 + tolerance):
+            found.append(f"{name}: p50 {base.p50:.2f}us -> {result.p50:.2f}us (+{result.p50 / base.p50 - 1:.0%})")
+        if result.peak_bytes > base.peak_bytes * (1 + tolerance) + 1024:
+            found.append(f"{name}: peak {base.peak_bytes:.0f}B -> {result.peak_bytes:.0f}B")
+    return found
+
+
+def main() -> None:  # noqa: D103
+    parser = argparse.ArgumentParser(description=__doc__)
+    add_question_set_arguments(parser)
+    parser.add_argument("--samples", type=int, default=500, help="Number of seeds per case")
+    parser.add_argument("--seed", type=int, default=0, help="The first seed of every case")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of timing rounds, the fastest one is kept")
+    parser.add_argument("--filter", default="", help="Only run the cases whose name starts with this")
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown before a regression")
+    parser.add_argument("--update", action="store_true", help="Store the results as the baseline")
+    args = parser.parse_args()
+
+    # the questions failing to generate are part of the measure, not logged
+    logging.getLogger("app").disabled = True
+    question_set = load_question_set(args.question_set, args.table_directory)
+
+    results: dict[str, BenchResult] = {}
+    print(f"{'case':<16}{'ops/s':>10}{'p50 (us)':>10}{'p90 (us)':>10}{'p99 (us)':>10}{'peak (B)':>10}{'blocks':>8}")
+    for name, case in cases(question_set).items():
+        if not name.startswith(args.filter):
+            continue
+        case(args.seed)  # warm up the compiled templates and validators
+        result = results[name] = run_case(case, args.samples, args.seed, args.repeat)
+        print(
+            f"{name:<16}{result.throughput:>10.0f}{result.p50:>10.2f}{result.p90:>10.2f}{result.p99:>10.2f}"
+            f"{result.peak_bytes:>10.0f}{result.retained_blocks:>8.2f}",
+        )
+
+    if args.update:
+        baseline = decode(args.baseline.read_bytes(), type=dict[str, BenchResult]) if args.baseline.exists() else {}
+        args.baseline.write_bytes(format(encode({**baseline, **results})) + b"\n")
+        print(f"\nBaseline updated: {args.baseline}")
+        return
+    if not args.baseline.exists():
+        args.baseline.write_bytes(format(encode(results)) + b"\n")
+        print(f"\nNo baseline yet, stored the results as the baseline: {args.baseline}")
+        return
+    found = regressions(results, decode(args.baseline.read_bytes(), type=dict[str, BenchResult]), args.tolerance)
+    print(f"\n{len(found)} regressions beyond {args.tolerance:.0%} of {args.baseline}")
+    for line in found:
+        print(f"  {line}")
+    if found:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""Check the startup import time of the captcha server against the budget stored in `importtime.json`.
+
+The budget is the ratio of the import time to the one of a reference module measured in the same run, such as
+`litestar`, so it holds on a faster or slower machine. Exit with 1 if a module deferred to first use is imported at
+startup, and with `--strict` also if the ratio exceeds the budget, otherwise it is only reported.
+Run with `uv run python -m server.captcha.bench.importtime`, add `--update` to store the current ratio as the budget.
+"""
+
+import argparse
+import subprocess
+import sys
+from pathlib import Path
+
+from msgspec import Struct
+from msgspec.json import decode, encode, format
+
+DEFAULT_BUDGET = Path(__file__).with_name("importtime.json")
+DEFAULT_MODULE = "server.captcha.main"
+
+
+class ImportBudget(Struct):
+    """The stored startup import budget."""
+
+    module: str
+    reference: str
+    budget_ratio: float
+    deferred: list[str]
+
+
+class ImportTime(Struct):
+    """One line of `-X importtime`, in microseconds."""
+
+    name: str
+    self_us: int
+    cumulative_us: int
+    depth: int
+
+
+def measure(module: str) -> list[ImportTime]:
+    """Import `module` in a fresh interpreter with `-X importtime`.
+
+    Returns:
+        list[ImportTime]: Every module imported, in the order their import finished.
+
+    Raises:
+        RuntimeError: If the import failed.
+
+    """
+    process = subprocess.run(  # noqa: S603 only runs the current interpreter
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+    if process.returncode != 0:
+        raise RuntimeError(f"Failed to import {module}:\n{process.stderr}")
+    times: list[ImportTime] = []
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line.removeprefix("import time:").split("|")
+        times.append(
+            ImportTime(
+                name=name.strip(),
+                self_us=int(self_us),
+                cumulative_us=int(cumulative_us),
+                depth=(len(name) - len(name.lstrip())) // 2,
+            ),
+        )
+    return times
+
+
+def fastest(module: str, runs: int) -> list[ImportTime]:
+    """Import `module` `runs` times in a fresh interpreter.
+
+    Returns:
+        list[ImportTime]: The imports of the fastest run.
+
+    """
+    return min((measure(module) for _ in range(runs)), key=total_ms)
+
+
+def total_ms(times: list[ImportTime]) -> float:
+    """Get the total import time of a run.
+
+    Returns:
+        float: The sum of the self time of every import, in milliseconds.
+
+    """
+    return sum(time.self_us for time in times) / 1000
+
+
+def main() -> None:  # noqa: D103
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--budget", type=Path, default=DEFAULT_BUDGET, help="The stored budget")
+    parser.add_argument("--runs", type=int, default=3, help="Number of imports, the fastest one is kept")
+    parser.add_argument("--top", type=int, default=10, help="Number of slowest top-level imports to show")
+    parser.add_argument("--update", action="store_true", help="Store the measured ratio with headroom as the budget")
+    parser.add_argument("--headroom", type=float, default=0.5, help="Fraction added to the ratio by --update")
+    parser.add_argument("--strict", action="store_true", help="Also exit with 1 if the ratio exceeds the budget")
+    args = parser.parse_args()
+
+    budget = decode(args.budget.read_bytes(), type=ImportBudget)
+    times = fastest(budget.module, args.runs)
+    module_ms, reference_ms = total_ms(times), total_ms(fastest(budget.reference, args.runs))
+    ratio = module_ms / reference_ms
+
+    for time in sorted((time for time in times if time.depth == 1), key=lambda time: -time.cumulative_us)[: args.top]:
+        print(f"{time.cumulative_us / 1000:>10.1f}ms  {time.name}")
+    print(
+        f"\nimport {budget.module}: {module_ms:.1f}ms, import {budget.reference}: {reference_ms:.1f}ms, "
+        f"ratio {ratio:.2f}, budget {budget.budget_ratio:.2f}",
+    )
+
+    if args.update:
+        budget.budget_ratio = round(ratio * (1 + args.headroom), 2)
+        args.budget.write_bytes(format(encode(budget)) + b"\n")
+        print(f"Budget updated to {budget.budget_ratio:.2f}")
+        return
+
+    failed = False
+    imported = {time.name for time in times}
+    for name in budget.deferred:
+        if name in imported:
+            print(f"FAIL: {name} is imported at startup, it should be imported on first use")
+            failed = True
+    if ratio > budget.budget_ratio:
+        print(
+            f"{'FAIL' if args.strict else 'WARN'}: startup import time is {ratio:.2f} times the one of "
+            f"{budget.reference}, over the budget of {budget.budget_ratio:.2f}",
+        )
+        failed = failed or args.strict
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
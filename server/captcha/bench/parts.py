@@ -0,0 +1,97 @@
+"""Benchmark the generation time of questions by their amount of parts, which should stay linear.
+
+Run with `uv run python -m server.captcha.bench.parts`.
+"""
+
+import argparse
+import logging
+import statistics
+import time
+from pathlib import Path
+
+from msgspec import Struct
+from msgspec.json import encode, format
+from server.captcha.bench.common import add_question_set_arguments, load_question_set
+from server.captcha.lib.utils import question_generator
+from server.captcha.schema.questions import QuestionSet
+
+DEFAULT_PARTS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+# Prefix of the question replacing one which failed to generate
+INVALID_QUESTION = "You found an invalid question"
+
+
+class PartsTiming(Struct):
+    """The generation time of questions of one amount of parts."""
+
+    parts: int
+    samples: int
+    p50: float
+    p90: float
+    per_part: float
+    collapsed: float
+    invalid: float
+    redraws: float
+
+
+def time_parts(question_set: QuestionSet, parts: int, samples: int, seed: int = 0) -> PartsTiming:
+    """Generate `samples` questions of `parts` parts.
+
+    Returns:
+        PartsTiming: The timing percentiles in milliseconds, the median per part in microseconds,
+            and the rate of collapsed and invalid questions.
+
+    """
+    times: list[float] = []
+    collapsed = invalid = redraws = 0
+    for offset in range(samples):
+        start = time.perf_counter()
+        question = question_generator(question_set, seed=seed + offset, parts=parts)
+        times.append(time.perf_counter() - start)
+        collapsed += question.collapsed
+        invalid += question.question.startswith(INVALID_QUESTION)
+        redraws += len(question.rejected_parts)
+    times.sort()
+    p50 = statistics.median(times)
+    return PartsTiming(
+        parts=parts,
+        samples=samples,
+        p50=p50 * 1e3,
+        p90=times[int(0.9 * (len(times) - 1))] * 1e3,
+        per_part=p50 * 1e6 / max(parts, 1),
+        collapsed=collapsed / samples,
+        invalid=invalid / samples,
+        redraws=redraws / samples,
+    )
+
+
+def main() -> None:  # noqa: D103
+    parser = argparse.ArgumentParser(description=__doc__)
+    add_question_set_arguments(parser)
+    parser.add_argument("--parts", type=int, nargs="+", default=DEFAULT_PARTS, help="Amounts of parts to measure")
+    parser.add_argument("--budget", type=float, default=0.2, help="Seconds of generation for each amount of parts")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", type=Path, help="Also write the report as JSON to this path")
+    args = parser.parse_args()
+
+    # the questions failing to generate are counted, not logged
+    logging.getLogger("app").disabled = True
+    question_set = load_question_set(args.question_set, args.table_directory)
+    question_generator(question_set, seed=args.seed, parts=max(args.parts))  # warm up the caches
+
+    timings: list[PartsTiming] = []
+    print(f"{'parts':>6}{'p50 (ms)':>10}{'p90 (ms)':>10}{'us/part':>9}{'collapsed':>11}{'invalid':>9}{'redraws':>9}")
+    for parts in args.parts:
+        # a quick estimate, so each amount of parts is measured for about the same time
+        estimate = time_parts(question_set, parts, 3, args.seed).p50 / 1e3
+        timing = time_parts(question_set, parts, max(5, int(args.budget / max(estimate, 1e-6))), args.seed)
+        timings.append(timing)
+        print(
+            f"{timing.parts:>6}{timing.p50:>10.2f}{timing.p90:>10.2f}{timing.per_part:>9.1f}"
+            f"{timing.collapsed:>11.1%}{timing.invalid:>9.1%}{timing.redraws:>9.2f}",
+        )
+    if args.json is not None:
+        args.json.write_bytes(format(encode(timings)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Benchmark the size and the encode time of the question images by PNG encoding, across the render widths.
+
+The `rgb` encoding is the antialiased RGB image with Pillow's default settings, as the images were encoded before.
+Run with `uv run python -m server.captcha.bench.png`.
+"""
+
+import argparse
+import logging
+import statistics
+import time
+from functools import partial
+from io import BytesIO
+
+from PIL import Image
+from server.captcha.bench.common import add_question_set_arguments, load_question_set
+from server.captcha.bench.render import DEFAULT_CASES
+from server.captcha.lib.config import RENDER_BACKEND, RENDER_PNG_COMPRESS_LEVEL, RENDER_WIDTHS
+from server.captcha.lib.render import PNG_STRATEGIES, PngEncoding, draw_text_image, encode_png
+from server.captcha.lib.utils import question_generator
+
+# Base64 encodes 3 bytes in 4 characters
+BASE64_RATIO = 4 / 3
+
+
+def encode_rgb(image: Image.Image) -> bytes:
+    """Encode the image as RGB with Pillow's default settings, as before the palette encodings.
+
+    Returns:
+        bytes: The PNG image.
+
+    """
+    buffer = BytesIO()
+    image.convert("RGB").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def main() -> None:  # noqa: D103
+    parser = argparse.ArgumentParser(description=__doc__)
+    add_question_set_arguments(parser)
+    parser.add_argument("--questions", type=int, default=4, help="Number of questions of each case")
+    parser.add_argument("--widths", type=int, nargs="+", default=RENDER_WIDTHS)
+    parser.add_argument("--colors", type=int, nargs="+", default=(2, 4, 256), help="Gray levels to measure")
+    parser.add_argument("--strategies", nargs="+", default=("default", "rle"), choices=PNG_STRATEGIES)
+    parser.add_argument("--compress-level", type=int, default=RENDER_PNG_COMPRESS_LEVEL)
+    parser.add_argument("--repeat", type=int, default=3, help="Number of encodes of each image, the fastest is kept")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    # the questions failing to generate are still rendered, not logged
+    logging.getLogger("app").disabled = True
+    question_set = load_question_set(args.question_set, args.table_directory)
+    encodings = [
+        PngEncoding(colors=colors, compress_level=args.compress_level, strategy=strategy)
+        for colors in args.colors
+        for strategy in args.strategies
+    ]
+
+    print(f"{'case':<10}{'width':>6}  {'encoding':<16}{'bytes':>9}{'base64':>9}{'ratio':>7}{'encode (ms)':>13}")
+    for name, parts in DEFAULT_CASES.items():
+        questions = [
+            question_generator(question_set, seed=args.seed + offset, parts=parts).question
+            for offset in range(args.questions)
+        ]
+        for width in args.widths:
+            images = {
+                antialias: [draw_text_image(q, width, backend=RENDER_BACKEND, antialias=antialias) for q in questions]
+                for antialias in (True, False)
+            }
+            encoders = [
+                ("rgb", True, encode_rgb),
+                *(
+                    (
+                        f"{encoding.colors}/{encoding.strategy}",
+                        encoding.antialias,
+                        partial(encode_png, encoding=encoding),
+                    )
+                    for encoding in encodings
+                ),
+            ]
+            reference = 0.0
+            for label, antialias, encoder in encoders:
+                sizes: list[int] = []
+                times: list[float] = []
+                for image in images[antialias]:
+                    best = float("inf")
+                    for _ in range(args.repeat):
+                        start = time.perf_counter()
+                        encoded = encoder(image)
+                        best = min(best, time.perf_counter() - start)
+                    sizes.append(len(encoded))
+                    times.append(best)
+                size = statistics.mean(sizes)
+                reference = reference or size
+                print(
+                    f"{name:<10}{width:>6}  {label:<16}{size:>9.0f}{size * BASE64_RATIO:>9.0f}"
+                    f"{size / reference:>7.2f}{statistics.mean(times) * 1e3:>13.2f}",
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Benchmark the renders per second of the question images by backend, for short questions and 100-step questions.
+
+Every backend renders the same questions, and reports the fraction of their pixels differing from the first one.
+Run with `uv run python -m server.captcha.bench.render`.
+"""
+
+import argparse
+import logging
+import time
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+from server.captcha.bench.common import add_question_set_arguments, load_question_set
+from server.captcha.lib.metrics import percentile
+from server.captcha.lib.render import RenderBackend, text_to_image
+from server.captcha.lib.utils import question_generator
+
+# The amount of parts of each case, `None` for the `construct` of the question set
+DEFAULT_CASES: dict[str, int | None] = {"short": None, "100-step": 100}
+# The first one is the reference the images of the others are compared to
+BACKENDS: tuple[RenderBackend, ...] = ("pil", "atlas")
+
+
+def _pixels(image: bytes) -> bytes:
+    return Image.open(BytesIO(image)).convert("L").tobytes()
+
+
+def _differing(pixels: bytes, expected: bytes) -> int:
+    if len(pixels) != len(expected):
+        return len(expected)
+    return int(np.count_nonzero(np.frombuffer(pixels, dtype=np.uint8) != np.frombuffer(expected, dtype=np.uint8)))
+
+
+def time_renders(questions: list[str], width: int, backend: RenderBackend, budget: float) -> list[float]:
+    """Render the questions in turn for about `budget` seconds.
+
+    Returns:
+        list[float]: The sorted seconds of every render.
+
+    """
+    times: list[float] = []
+    end = time.perf_counter() + budget
+    while not times or time.perf_counter() < end:
+        for question in questions:
+            start = time.perf_counter()
+            text_to_image(question, width=width, backend=backend)
+            times.append(time.perf_counter() - start)
+    return sorted(times)
+
+
+def main() -> None:  # noqa: D103
+    parser = argparse.ArgumentParser(description=__doc__)
+    add_question_set_arguments(parser)
+    parser.add_argument("--questions", type=int, default=8, help="Number of questions of each case")
+    parser.add_argument("--width", type=int, default=800)
+    parser.add_argument("--budget", type=float, default=2, help="Seconds of rendering of each case and backend")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    # the questions failing to generate are still rendered, not logged
+    logging.getLogger("app").disabled = True
+    question_set = load_question_set(args.question_set, args.table_directory)
+
+    print(f"{'case':<10}{'backend':<8}{'chars':>7}{'renders/s':>11}{'p50 (ms)':>10}{'p99 (ms)':>10}{'diff':>8}")
+    for name, parts in DEFAULT_CASES.items():
+        questions = [
+            question_generator(question_set, seed=args.seed + offset, parts=parts).question
+            for offset in range(args.questions)
+        ]
+        chars = sum(map(len, questions)) // len(questions)
+        # also warms up the fonts and the atlas
+        expected = [_pixels(text_to_image(question, width=args.width, backend=BACKENDS[0])) for question in questions]
+        for backend in BACKENDS:
+            differing = sum(
+                _differing(_pixels(text_to_image(question, width=args.width, backend=backend)), pixels)
+                for question, pixels in zip(questions, expected, strict=True)
+            )
+            times = time_renders(questions, args.width, backend, args.budget)
+            print(
+                f"{name:<10}{backend:<8}{chars:>7}{len(times) / sum(times):>11.1f}"
+                f"{percentile(times, 0.5) * 1e3:>10.2f}{percentile(times, 0.99) * 1e3:>10.2f}"
+                f"{differing / sum(map(len, expected)):>8.3%}",
+            )
+
+
+if __name__ == "__main__":
+    main()
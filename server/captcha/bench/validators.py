@@ -0,0 +1,169 @@
+"""Benchmark the `exec` validator path against the precompiled validator factories, and the numpy evaluation.
+
+Run with `uv run python -m server.captcha.bench.validators`.
+"""
+
+import argparse
+import time
+from collections.abc import Callable
+from random import Random
+
+import numpy as np
+from server.captcha.bench.common import add_question_set_arguments, load_question_set
+from server.captcha.lib.utils import fill_question
+from server.captcha.lib.validator import SAFE_GLOBALS, compile_validator
+from server.captcha.lib.vectorize import VectorFallbackError, compile_vector_validator, to_list
+from server.captcha.schema.questions import Part, Question, QuestionSection
+
+# Templates whose placeholders cannot all be parameters, or with several lines, checked along the question set
+EDGE_CASES = (
+    "validator=lambda x: str(x).count('{y}')",
+    "import math\nvalidator=lambda x: x+{y}",
+    "validator=lambda x: x*1{y}",
+    "validator=lambda x: x*{y}.5",
+    "validator=lambda x: x+{y}\nvalidator=lambda x, step=validator: step(x)*2",
+)
+
+
+def _exec_validator(section: QuestionSection) -> Callable[[int], int]:
+    """Build the validator the way `question_generator` used to: `exec` the filled source on every request.
+
+    Returns:
+        Callable[[int], int]: The validator function.
+
+    """
+    locals_dict = {}
+    exec(section.validator, dict(SAFE_GLOBALS), locals_dict)  # noqa: S102 benchmark of the previous implementation
+    return locals_dict["validator"]
+
+
+def _one_line(validator: str) -> str:
+    return validator.replace("\n", "; ")
+
+
+def _compiled_validator(entry: Part, section: QuestionSection) -> Callable[[int], int]:
+    return compile_validator(entry.validator).bind(section.values)
+
+
+def _run(fn_builder: Callable[[], Callable[[int], int]], tasks: list[int]) -> tuple[float, list[int] | str]:
+    start = time.perf_counter()
+    try:
+        result: list[int] | str = list(map(fn_builder(), tasks))
+    except Exception as e:  # noqa: BLE001 the exception type is compared between both path
+        result = type(e).__name__
+    return time.perf_counter() - start, result
+
+
+def bench_entry(entry: Part, rounds: int, seed: int) -> tuple[float, float, int]:
+    """Time both validator path for one `base` or `part` entry.
+
+    Returns:
+        tuple[float, float, int]: Total seconds of the exec path, the compiled path and the number of mismatch.
+
+    """
+    random_obj = Random(seed)  # noqa: S311 benchmark need to be reproducible
+    value_range = entry.input if isinstance(entry, Question) else (1, 65536)
+    exec_total = compiled_total = 0.0
+    mismatch = 0
+    for _ in range(rounds):
+        section = fill_question(entry, random_obj)
+        tasks = [random_obj.randint(*value_range) for _ in range(random_obj.randint(5, 12))]
+        exec_time, exec_result = _run(lambda section=section: _exec_validator(section), tasks)
+        compiled_time, compiled_result = _run(lambda section=section: _compiled_validator(entry, section), tasks)
+        exec_total += exec_time
+        compiled_total += compiled_time
+        mismatch += exec_result != compiled_result
+    return exec_total, compiled_total, mismatch
+
+
+def bench_vector(entry: Part, rounds: int, seed: int, task_amount: int) -> tuple[float, float, int] | None:
+    """Time the python validator against the int64 vector evaluation on `task_amount` tasks.
+
+    Returns:
+        tuple[float, float, int] | None: Total seconds of the python path, the vector path and the number of mismatch,
+            or `None` if the entry cannot be vectorized.
+
+    """
+    vector_fn = compile_vector_validator(entry.validator)
+    if vector_fn is None:
+        return None
+    random_obj = Random(seed)  # noqa: S311 benchmark need to be reproducible
+    value_range = entry.input if isinstance(entry, Question) else (1, 65536)
+    python_total = vector_total = 0.0
+    mismatch = 0
+    for _ in range(rounds):
+        section = fill_question(entry, random_obj)
+        tasks = [random_obj.randint(*value_range) for _ in range(task_amount)]
+        python_time, python_result = _run(lambda section=section: _compiled_validator(entry, section), tasks)
+        start = time.perf_counter()
+        try:
+            vector_result: list[int] | str = to_list(vector_fn(section.values, np.array(tasks, dtype=np.int64)))
+        except VectorFallbackError:
+            vector_result = python_result
+        except Exception as e:  # noqa: BLE001 the exception type is compared between both path
+            vector_result = type(e).__name__
+        vector_total += time.perf_counter() - start
+        python_total += python_time
+        mismatch += python_result != vector_result
+    return python_total, vector_total, mismatch
+
+
+def main() -> None:  # noqa: D103
+    parser = argparse.ArgumentParser(description=__doc__)
+    add_question_set_arguments(parser, table=False)
+    parser.add_argument("--rounds", type=int, default=200, help="Number of filled question per entry")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--vector-tasks", type=int, default=4096, help="Number of tasks for the numpy evaluation")
+    args = parser.parse_args()
+
+    question_set = load_question_set(args.question_set)
+    entries: list[tuple[str, int, Part]] = [
+        *(("base", i, entry) for i, entry in enumerate(question_set.base)),
+        *(("part", i, entry) for i, entry in enumerate(question_set.part)),
+        *(
+            ("edge", i, Part(question="", validator=validator, range={"y": (1, 9)}))
+            for i, validator in enumerate(EDGE_CASES)
+        ),
+    ]
+
+    start = time.perf_counter()
+    for _, _, entry in entries:
+        compile_validator(entry.validator)
+    compile_time = time.perf_counter() - start
+
+    print(f"{'entry':<10}{'exec (us)':>12}{'compiled (us)':>15}{'speedup':>10}{'mismatch':>10}  validator")
+    exec_sum = compiled_sum = 0.0
+    mismatch_sum = 0
+    for kind, index, entry in entries:
+        exec_total, compiled_total, mismatch = bench_entry(entry, args.rounds, args.seed + index)
+        exec_sum += exec_total
+        compiled_sum += compiled_total
+        mismatch_sum += mismatch
+        print(
+            f"{kind}[{index}]".ljust(10)
+            + f"{exec_total / args.rounds * 1e6:>12.2f}{compiled_total / args.rounds * 1e6:>15.2f}"
+            + f"{exec_total / compiled_total:>9.1f}x{mismatch:>10}  {_one_line(entry.validator)}",
+        )
+    print(
+        f"\n{len(entries)} entries, {args.rounds} rounds each, "
+        f"one-off compile of all entries: {compile_time * 1e3:.2f}ms"
+        f"\nexec: {exec_sum:.3f}s, compiled: {compiled_sum:.3f}s, speedup: {exec_sum / compiled_sum:.1f}x, "
+        f"mismatch: {mismatch_sum}",
+    )
+
+    print(f"\n{'entry':<10}{'python (us)':>12}{'numpy (us)':>15}{'speedup':>10}{'mismatch':>10}  validator")
+    for kind, index, entry in entries:
+        result = bench_vector(entry, max(1, args.rounds // 10), args.seed + index, args.vector_tasks)
+        if result is None:
+            continue
+        python_total, vector_total, mismatch = result
+        rounds = max(1, args.rounds // 10)
+        print(
+            f"{kind}[{index}]".ljust(10)
+            + f"{python_total / rounds * 1e6:>12.2f}{vector_total / rounds * 1e6:>15.2f}"
+            + f"{python_total / vector_total:>9.1f}x{mismatch:>10}  {_one_line(entry.validator)}",
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,4 @@
-import base64
-import textwrap
-from io import BytesIO
+import asyncio
 from os import getenv
 from pathlib import Path
 from typing import TYPE_CHECKING
@@ -12,70 +10,87 @@ from crypto.key import import_private_key
 from litestar import Request, Response, get, post, status_codes
 from litestar.controller import Controller
 from litestar.di import Provide
+from litestar.exceptions import ServiceUnavailableException, ValidationException
 from litestar.status_codes import HTTP_200_OK
-from PIL import Image, ImageDraw, ImageFont
+from server.captcha.lib.config import (
+    CHALLENGE_BULK_MAX,
+    CHALLENGE_BULK_PARTS_MAX,
+    CHALLENGE_BULK_SIZED_MAX,
+    CHALLENGE_LIFETIME,
+    QUESTION_SANDBOX_RETRY_AFTER,
+    QUESTION_TIERS,
+    RENDER_RETRY_AFTER,
+)
 from server.captcha.lib.dependencies import provide_challenge_service
+from server.captcha.lib.render import RenderQueueFullError, bucket_width, image_etag
+from server.captcha.lib.sandbox import SandboxError
 from server.captcha.lib.services import ChallengeService
-from server.captcha.lib.utils import question_generator
+from server.captcha.lib.template import average_parts
 from server.captcha.schema.challenge import (
     GenerateChallengeRequest,
     GenerateChallengeResponse,
+    GenerateChallengesRequest,
+    GenerateChallengesResponse,
     GetChallengeResponse,
     SubmitChallengeRequest,
 )
 
 if TYPE_CHECKING:
-    from server.captcha.schema.questions import GeneratedQuestion, QuestionSet
+    from server.captcha.lib.pool import QuestionPool
+    from server.captcha.lib.question_store import QuestionStore
+    from server.captcha.lib.render import Renderer
+    from server.captcha.schema.questions import GeneratedQuestion
 
 KEY_PATH = Path(getenv("KEY_PATH", "./captcha_data"))
-FONT_PATH = Path(getenv("FONT_PATH", "./captcha_data/JetBrainsMono-Regular.ttf"))
-
+# The image of a challenge never changes, it can be cached by the browser and shared caches until the challenge expires
+IMAGE_CACHE_CONTROL = f"public, max-age={int(CHALLENGE_LIFETIME)}, immutable"
 
-def text_to_image(text: str, width: int = 800, font_size: int = 12) -> str:
-    """Convert text to base64 encoded PNG image.
 
-    Args:
-        text: The text to convert to image
-        width: Width of the image
-        font_size: Font size for the text
+def requested_parts(data: GenerateChallengeRequest) -> int | None:
+    """Get the amount of parts requested by `parts` or `tier`.
 
     Returns:
-        str: Base64 encoded PNG image as data URL
+        int | None: The amount of parts, `None` to pick a `construct` of the question set.
+
+    Raises:
+        ValidationException: If both are given, or the tier does not exist.
 
     """
-    try:
-        font = ImageFont.truetype(FONT_PATH, font_size)
-    except OSError:
-        try:
-            font = ImageFont.truetype("arial.ttf", font_size)
-        except OSError:
-            font = ImageFont.load_default()
+    if data.tier is None:
+        return data.parts
+    if data.parts is not None:
+        raise ValidationException(detail="Only one of `parts` and `tier` can be given")
+    if data.tier not in QUESTION_TIERS:
+        raise ValidationException(detail=f"Unknown tier, expected one of {', '.join(QUESTION_TIERS)}")
+    return QUESTION_TIERS[data.tier]
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """Whether an `If-None-Match` header lists the ETag, with the weak comparison it uses.
 
-    wrapped_lines = []
-    character_width = (font_size + 4) // 2
-    for line in text.split("\n"):
-        if line.strip():
-            wrapped = textwrap.fill(line, width=(width - 20) // character_width)
-            wrapped_lines.extend(wrapped.split("\n"))
-        else:
-            wrapped_lines.append("")
+    `*` is not matched, it would answer 304 for a challenge that does not exist or expired, as this is checked before
+    looking up the challenge. Only a client that fetched the image of this very challenge sends its ETag.
 
-    line_height = font_size + 4
-    img_height = max(60, len(wrapped_lines) * line_height + 20)
+    Returns:
+        bool: `True` if the header lists the ETag.
+
+    """
+    if if_none_match is None:
+        return False
+    return etag in {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
 
-    img = Image.new("RGB", (width, img_height), color="white")
-    draw = ImageDraw.Draw(img)
 
-    y_position = 10
-    for line in wrapped_lines:
-        draw.text((10, y_position), line, fill="black", font=font)
-        y_position += line_height
+def generation_unavailable() -> ServiceUnavailableException:
+    """Get the 503 of a question still killed in its sandbox worker after the retries.
 
-    buffer = BytesIO()
-    img.save(buffer, format="PNG")
-    img_data = buffer.getvalue()
-    buffer.close()
-    return base64.b64encode(img_data).decode("utf-8")
+    Returns:
+        ServiceUnavailableException: The exception to raise, with a `Retry-After`.
+
+    """
+    return ServiceUnavailableException(
+        detail="The question could not be generated, retry later",
+        headers={"Retry-After": str(QUESTION_SANDBOX_RETRY_AFTER)},
+    )
 
 
 class ChallengeController(Controller):  # noqa: D101
@@ -92,14 +107,22 @@ class ChallengeController(Controller):  # noqa: D101
         challenge_service: ChallengeService,
         request: Request,
     ) -> GenerateChallengeResponse:
-        """Generate a new captcha challenge.
+        """Generate a new captcha challenge, of the amount of parts requested by `parts` or `tier` if any.
+
+        The question image at the default width is rendered in the background, ahead of its first fetch.
 
         Returns:
             GenerateChallengeResponse: The response containing the generated challenge ID.
 
+        Raises:
+            ServiceUnavailableException: If the question is killed in its sandbox worker after every retry.
+
         """
-        question_set: QuestionSet = request.app.state["question_set"]
-        question: GeneratedQuestion = question_generator(question_set)
+        question_pool: QuestionPool = request.app.state["question_pool"]
+        try:
+            question: GeneratedQuestion = await question_pool.get(requested_parts(data))
+        except SandboxError as e:
+            raise generation_unavailable() from e
 
         challenge = await challenge_service.create(
             {
@@ -108,32 +131,132 @@ class ChallengeController(Controller):  # noqa: D101
                 "question": question.question,
                 "tasks": str(question.tasks),
                 "answers": str(question.solutions),
+                "question_set_version": question.version,
             },
         )
+        renderer: Renderer = request.app.state["renderer"]
+        renderer.prerender(challenge)
 
         return GenerateChallengeResponse(challenge_id=challenge.id)
 
+    @post("/generate-challenges")
+    async def generate_challenges(
+        self,
+        data: GenerateChallengesRequest,
+        challenge_service: ChallengeService,
+        request: Request,
+    ) -> GenerateChallengesResponse:
+        """Generate `count` captcha challenges for each website and session, in a single transaction.
+
+        Returns:
+            GenerateChallengesResponse: The response containing the generated challenge IDs.
+
+        Raises:
+            ValidationException: If more than `CHALLENGE_BULK_MAX` challenges are requested, more than
+                `CHALLENGE_BULK_SIZED_MAX` when any sets `parts` or `tier`, or more than `CHALLENGE_BULK_PARTS_MAX`
+                parts in total.
+            ServiceUnavailableException: If a question is killed in its sandbox worker after every retry.
+
+        """
+        amount = len(data.challenges) * data.count
+        if amount > CHALLENGE_BULK_MAX:
+            raise ValidationException(detail=f"At most {CHALLENGE_BULK_MAX} challenges can be generated at once")
+        parts = [requested_parts(target) for target in data.challenges]
+        if amount > CHALLENGE_BULK_SIZED_MAX and any(target is not None for target in parts):
+            raise ValidationException(
+                detail=f"At most {CHALLENGE_BULK_SIZED_MAX} challenges with `parts` or `tier` can be generated "
+                "at once",
+            )
+        store: QuestionStore = request.app.state["question_store"]
+        construct_parts = average_parts(store.current)
+        total_parts = data.count * sum(construct_parts if target is None else target for target in parts)
+        if total_parts > CHALLENGE_BULK_PARTS_MAX:
+            raise ValidationException(
+                detail=f"At most {CHALLENGE_BULK_PARTS_MAX} parts can be generated at once, not {total_parts:.0f}",
+            )
+        question_pool: QuestionPool = request.app.state["question_pool"]
+        try:
+            batches = await asyncio.gather(*(question_pool.get_many(data.count, target) for target in parts))
+        except SandboxError as e:
+            raise generation_unavailable() from e
+
+        challenges = await challenge_service.create_many(
+            [
+                {
+                    "website": target.website,
+                    "session_id": target.session_id,
+                    "question": question.question,
+                    "tasks": str(question.tasks),
+                    "answers": str(question.solutions),
+                    "question_set_version": question.version,
+                }
+                for target, batch in zip(data.challenges, batches, strict=True)
+                for question in batch
+            ],
+        )
+        renderer: Renderer = request.app.state["renderer"]
+        for challenge in challenges:
+            renderer.prerender(challenge)
+
+        return GenerateChallengesResponse(challenge_ids=[challenge.id for challenge in challenges])
+
     @get("/get-challenge/{challenge_id:uuid}")
     async def get_challenge(
         self,
         challenge_service: ChallengeService,
         challenge_id: UUID,
+        request: Request,
         width: int | None = 640,
     ) -> GetChallengeResponse:
-        """Get the current captcha challenge.
+        """Get the current captcha challenge, with the URL of the question image at the bucket of `width`.
 
         Returns:
             GetChallengeResponse: The response containing the challenge details.
 
         """
         challenge = await challenge_service.get_one(id=challenge_id)
-        if not width:
-            width = 640
+        image_path = request.app.route_reverse("challenge-image", challenge_id=challenge.id)
         return GetChallengeResponse(
-            question=text_to_image(challenge.question, width=width),
+            image_url=f"{image_path}?width={bucket_width(width or 640)}",
             tasks=challenge.task_list,
         )
 
+    @get("/{challenge_id:uuid}/image.png", name="challenge-image", media_type="image/png")
+    async def get_challenge_image(
+        self,
+        challenge_service: ChallengeService,
+        challenge_id: UUID,
+        request: Request,
+        width: int | None = 640,
+    ) -> Response[bytes]:
+        """Get the question image of a challenge as PNG, rendered at the bucket of `width`.
+
+        The image is cached by the browser for the lifetime of the challenge, and a request with the `If-None-Match`
+        of its ETag is answered 304 without looking up the challenge.
+
+        Returns:
+            Response[bytes]: The PNG image, or an empty 304 response.
+
+        Raises:
+            ServiceUnavailableException: If every render worker is busy and the render queue is full.
+
+        """
+        width = bucket_width(width or 640)
+        headers = {"ETag": image_etag(challenge_id, width), "Cache-Control": IMAGE_CACHE_CONTROL}
+        if etag_matches(request.headers.get("If-None-Match"), headers["ETag"]):
+            return Response(content=b"", status_code=status_codes.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        challenge = await challenge_service.get_one(id=challenge_id)
+        renderer: Renderer = request.app.state["renderer"]
+        try:
+            image = await renderer.render(challenge, width)
+        except RenderQueueFullError as e:
+            raise ServiceUnavailableException(
+                detail="Too many questions are being rendered, retry later",
+                headers={"Retry-After": str(RENDER_RETRY_AFTER)},
+            ) from e
+        return Response(content=image, headers=headers)
+
     @post("/submit-challenge")
     async def submit_challenge(
         self,
@@ -0,0 +1,60 @@
+from typing import TYPE_CHECKING
+
+from litestar import Request, get
+from litestar.controller import Controller
+from server.captcha.lib.memo import STEP_MEMO
+from server.captcha.lib.metrics import GENERATOR_METRICS
+from server.captcha.schema.metrics import GeneratorStats, QuestionPoolStats, RenderStats, StepMemoStats
+
+if TYPE_CHECKING:
+    from server.captcha.lib.pool import QuestionPool
+    from server.captcha.lib.render import Renderer
+
+
+class MetricsController(Controller):  # noqa: D101
+    path = "/api/metrics"
+    tags = ["Metrics"]
+
+    @get("/question-pool")
+    async def question_pool(self, request: Request) -> QuestionPoolStats:
+        """Get the depth and refill rate of the pre-generated question pool.
+
+        Returns:
+            QuestionPoolStats: The statistic of the question pool.
+
+        """
+        pool: QuestionPool = request.app.state["question_pool"]
+        return pool.stats()
+
+    @get("/generator")
+    async def generator(self) -> GeneratorStats:
+        """Get the statistic of the question generator, such as the growth guard and collapse rate by construct.
+
+        Returns:
+            GeneratorStats: The statistic of the question generator.
+
+        """
+        return GENERATOR_METRICS.stats()
+
+    @get("/step-memo")
+    async def step_memo(self) -> StepMemoStats:
+        """Get the size and hit rate of the memo of validator steps in the server process.
+
+        Questions pre-generated by `process` workers use the memo of their own process, which is not included.
+
+        Returns:
+            StepMemoStats: The statistic of the step memo.
+
+        """
+        return STEP_MEMO.stats()
+
+    @get("/render")
+    async def render(self, request: Request) -> RenderStats:
+        """Get the statistic of the rendering of the questions, such as the cache hits and the queue wait.
+
+        Returns:
+            RenderStats: The statistic of the rendering.
+
+        """
+        renderer: Renderer = request.app.state["renderer"]
+        return renderer.stats()
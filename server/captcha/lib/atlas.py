@@ -0,0 +1,176 @@
+import string
+import threading
+from math import ceil
+from typing import TYPE_CHECKING
+
+from server.captcha.lib.font import FONTS, Font
+from server.captcha.lib.lazy import lazy_import
+
+if TYPE_CHECKING:
+    import numpy as np
+    from PIL import Image, ImageDraw
+else:
+    np = lazy_import("numpy")
+    Image = lazy_import("PIL.Image")
+    ImageDraw = lazy_import("PIL.ImageDraw")
+
+# Rasterized when the atlas is created, other characters are added on first use
+ATLAS_CHARACTERS = string.digits + string.ascii_letters + string.punctuation + " "
+# Marks in the lookup of a character not rasterized yet, and of one without the advance of the other glyphs
+UNKNOWN = -1
+UNSUPPORTED = -2
+
+
+class GlyphAtlas:
+    """Every glyph of a monospaced font rasterized once, an image of text is assembled by copying them.
+
+    Each glyph is rasterized by Pillow at the origin of its cell in a box of 3x3 cells, then the boxes are cropped to
+    the extent of every glyph. As the glyphs of a monospaced font are on a fixed grid, the glyphs of the cells `stride`
+    apart never overlap, so the whole text is assembled with one gather of the cells per offset within the stride.
+    The darkest pixel is kept where glyphs overlap, as Pillow does, so antialiased images are pixel identical to
+    Pillow's. In monochrome mode Pillow moves some glyphs of a line a pixel up when the line has a `<` or a `>`,
+    while the atlas keeps every glyph where the font places it alone.
+    """
+
+    def __init__(self, font: Font, line_height: int, *, antialias: bool = True) -> None:
+        self.font: Font = font
+        self.line_height: int = line_height
+        self.antialias: bool = antialias
+        self.advance: int = int(font.getlength("M"))
+        self._lock: threading.Lock = threading.Lock()
+        # the coverage of every glyph in its 3x3 cells box, the first one is empty, for the padding of the lines
+        self._glyphs: list[np.ndarray] = [np.zeros((3 * line_height, 3 * self.advance), dtype=np.uint8)]
+        # index of the glyph of each code point
+        self._lookup: np.ndarray = np.full(128, UNKNOWN, dtype=np.int32)
+        # the glyphs cropped to their extent, the offset of the extent in the box, and the amount of cells it spans
+        self._layout: tuple[np.ndarray, tuple[int, int], tuple[int, int]] = (self._glyphs[0], (0, 0), (1, 1))
+        self.add(ATLAS_CHARACTERS)
+
+    @staticmethod
+    def supports(font: Font) -> bool:
+        """Whether the glyphs of the font are all on an integer grid, such as a monospaced TrueType font.
+
+        Returns:
+            bool: `True` if the font is monospaced with an integer advance.
+
+        """
+        if not hasattr(font, "getlength"):
+            return False
+        advances = {font.getlength(character) for character in ATLAS_CHARACTERS}
+        return len(advances) == 1 and next(iter(advances)).is_integer()
+
+    def _rasterize(self, character: str) -> np.ndarray:
+        image = Image.new("L", (3 * self.advance, 3 * self.line_height), color=255)
+        draw = ImageDraw.Draw(image)
+        draw.fontmode = "L" if self.antialias else "1"
+        draw.text((self.advance, self.line_height), character, fill=0, font=self.font)
+        return 255 - np.asarray(image)
+
+    def add(self, characters: str) -> None:
+        """Rasterize the characters missing from the atlas."""
+        with self._lock:
+            missing = sorted({c for c in characters if ord(c) >= len(self._lookup) or self._lookup[ord(c)] == UNKNOWN})
+            if not missing:
+                return
+            # a copy, so the renders running meanwhile never see a glyph before its layout
+            lookup = np.full(max(len(self._lookup), ord(missing[-1]) + 1), UNKNOWN, dtype=np.int32)
+            lookup[: len(self._lookup)] = self._lookup
+            for character in missing:
+                if self.font.getlength(character) != self.advance:
+                    lookup[ord(character)] = UNSUPPORTED
+                    continue
+                lookup[ord(character)] = len(self._glyphs)
+                self._glyphs.append(self._rasterize(character))
+
+            stacked = np.stack(self._glyphs)
+            rows = np.flatnonzero(stacked.any(axis=(0, 2)))
+            columns = np.flatnonzero(stacked.any(axis=(0, 1)))
+            top, left = (int(rows[0]), int(columns[0])) if len(rows) else (0, 0)
+            bottom, right = (int(rows[-1]) + 1, int(columns[-1]) + 1) if len(rows) else (1, 1)
+            stride = (ceil((bottom - top) / self.line_height), ceil((right - left) / self.advance))
+            cells = np.zeros((len(stacked), stride[0] * self.line_height, stride[1] * self.advance), dtype=np.uint8)
+            cells[:, : bottom - top, : right - left] = stacked[:, top:bottom, left:right]
+            # the glyphs are only appended, a render running meanwhile can keep using the previous layout
+            self._layout = (cells, (top, left), stride)
+            self._lookup = lookup
+
+    def grid(self, lines: list[str]) -> np.ndarray | None:
+        """Get the index of the glyph of every character of the lines, padded to the longest line.
+
+        Returns:
+            np.ndarray | None: The indexes, `None` if one of the characters does not have the advance of the font.
+
+        """
+        columns = max(map(len, lines), default=0)
+        text = "".join(line.ljust(columns) for line in lines)
+        codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32).reshape(len(lines), columns)
+        if codes.size and (int(codes.max()) >= len(self._lookup) or (self._lookup[codes] == UNKNOWN).any()):
+            self.add(text)
+        indexes = self._lookup[codes]
+        if (indexes == UNSUPPORTED).any():
+            return None
+        return indexes
+
+    def draw(self, lines: list[str], size: tuple[int, int], origin: tuple[int, int]) -> "Image.Image | None":
+        """Draw the lines black on white, the first one at `origin`, each `line_height` below the previous one.
+
+        Returns:
+            Image.Image | None: The grayscale image, `None` if one of the characters is not supported by the atlas.
+
+        """
+        if (indexes := self.grid(lines)) is None:
+            return None
+        cells, (top, left), (stride_y, stride_x) = self._layout
+        width, height = size
+        line_height, advance = self.line_height, self.advance
+        rows, columns = indexes.shape
+        # the glyphs are drawn one cell up and left of the cropped box, the canvas is shifted to keep them in
+        shift_y, shift_x = line_height, advance
+        canvas = np.zeros(
+            (
+                shift_y + max(height, origin[1] + top + (rows + stride_y) * line_height),
+                shift_x + max(width, origin[0] + left + (columns + stride_x) * advance),
+            ),
+            dtype=np.uint8,
+        )
+        cell_height, cell_width = cells.shape[1:]
+        for row in range(min(stride_y, rows)):
+            for column in range(min(stride_x, columns)):
+                block = cells[indexes[row::stride_y, column::stride_x]]
+                block_rows, block_columns = block.shape[:2]
+                block = block.transpose(0, 2, 1, 3).reshape(block_rows * cell_height, block_columns * cell_width)
+                y = shift_y + origin[1] + (row - 1) * line_height + top
+                x = shift_x + origin[0] + (column - 1) * advance + left
+                region = canvas[y : y + block.shape[0], x : x + block.shape[1]]
+                np.maximum(region, block, out=region)
+        visible = canvas[shift_y : shift_y + height, shift_x : shift_x + width]
+        return Image.fromarray(255 - visible)
+
+
+class AtlasRegistry:
+    """The glyph atlas of each font size and rasterization mode, created on first use."""
+
+    def __init__(self) -> None:
+        self._atlases: dict[tuple[int, int, bool], GlyphAtlas | None] = {}
+        self._lock: threading.Lock = threading.Lock()
+
+    def get(self, font_size: int, line_height: int, *, antialias: bool = True) -> GlyphAtlas | None:
+        """Get the atlas of the font of `font_size`, with antialiased glyphs or monochrome ones.
+
+        Returns:
+            GlyphAtlas | None: The atlas, `None` if the font is not monospaced.
+
+        """
+        key = (font_size, line_height, antialias)
+        if key in self._atlases:
+            return self._atlases[key]
+        with self._lock:
+            if key not in self._atlases:
+                font = FONTS.get(font_size)
+                self._atlases[key] = (
+                    GlyphAtlas(font, line_height, antialias=antialias) if GlyphAtlas.supports(font) else None
+                )
+            return self._atlases[key]
+
+
+ATLASES = AtlasRegistry()
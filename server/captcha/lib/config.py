@@ -1,3 +1,6 @@
+from os import getenv
+from pathlib import Path
+
 from dotenv import load_dotenv
 from litestar.plugins.sqlalchemy import (
     AsyncSessionConfig,
@@ -15,3 +18,78 @@ sqlalchemy_config = SQLAlchemyAsyncConfig(
     create_all=True,
 )
 alchemy_plugin = SQLAlchemyPlugin(config=sqlalchemy_config)
+
+# Font of the rendered questions, falling back to Arial then Pillow's default font if it cannot be loaded
+FONT_PATH = Path(getenv("FONT_PATH", "./captcha_data/JetBrainsMono-Regular.ttf"))
+
+# Widths the question images are rendered at, a requested width is snapped down to one of them.
+# The smallest and largest are the minimum and maximum width
+RENDER_WIDTHS = tuple(sorted(set(map(int, getenv("RENDER_WIDTHS", "320,480,640,800,1024,1280").split(",")))))
+# How the text of the question images is drawn, `pil` with FreeType line by line, or `atlas` by copying the glyphs of
+# the monospaced font rasterized once. Both draw the same pixels, up to a pixel shift of a few glyphs in monochrome
+RENDER_BACKEND = getenv("RENDER_BACKEND", "pil")
+# Gray levels of the question images, 2 for a 1-bit palette with monochrome glyphs, more for antialiased glyphs,
+# up to 256 for 8-bit grayscale. The zlib level and strategy (`default`, `filtered`, `huffman`, `rle` or `fixed`)
+# of their PNG compression
+RENDER_PNG_COLORS = int(getenv("RENDER_PNG_COLORS", "2"))
+RENDER_PNG_COMPRESS_LEVEL = int(getenv("RENDER_PNG_COMPRESS_LEVEL", "6"))
+RENDER_PNG_STRATEGY = getenv("RENDER_PNG_STRATEGY", "default")
+# Workers rendering the question images, `thread` or `process`, and the amount of renders waiting for a worker
+# before the question image endpoint answers 503 with `Retry-After` seconds
+RENDER_EXECUTOR = getenv("RENDER_EXECUTOR", "thread")
+RENDER_WORKERS = int(getenv("RENDER_WORKERS", "2"))
+RENDER_QUEUE_SIZE = int(getenv("RENDER_QUEUE_SIZE", "16"))
+RENDER_RETRY_AFTER = int(getenv("RENDER_RETRY_AFTER", "1"))
+# Width the question image of a new challenge is rendered at in the background, when a worker is free, 0 to disable
+RENDER_PRERENDER_WIDTH = int(getenv("RENDER_PRERENDER_WIDTH", "640"))
+# Seconds a challenge is expected to be solved in after it is generated, its rendered images are not cached longer
+CHALLENGE_LIFETIME = float(getenv("CHALLENGE_LIFETIME", "600"))
+# Memory budget in bytes of the cache of rendered question images, 0 to disable
+RENDER_CACHE_BYTES = int(getenv("RENDER_CACHE_BYTES", "67108864"))
+
+# Maximum amount of challenges of a single `generate-challenges` request, lower when any sets `parts` or `tier`,
+# and maximum total amount of `part` of its challenges
+CHALLENGE_BULK_MAX = int(getenv("CHALLENGE_BULK_MAX", "1000"))
+CHALLENGE_BULK_SIZED_MAX = int(getenv("CHALLENGE_BULK_SIZED_MAX", "100"))
+CHALLENGE_BULK_PARTS_MAX = int(getenv("CHALLENGE_BULK_PARTS_MAX", "10000"))
+
+# Pre-generated question pool
+QUESTION_POOL_SIZE = int(getenv("QUESTION_POOL_SIZE", "64"))
+QUESTION_POOL_WORKERS = int(getenv("QUESTION_POOL_WORKERS", "2"))
+QUESTION_POOL_EXECUTOR = getenv("QUESTION_POOL_EXECUTOR", "thread")
+# Limits of each question generated by the `sandbox` executor, 0 for no CPU or memory limit
+QUESTION_SANDBOX_TIMEOUT = float(getenv("QUESTION_SANDBOX_TIMEOUT", "5"))
+QUESTION_SANDBOX_CPU_SECONDS = int(getenv("QUESTION_SANDBOX_CPU_SECONDS", "10"))
+QUESTION_SANDBOX_MEMORY_BYTES = int(getenv("QUESTION_SANDBOX_MEMORY_BYTES", "2147483648"))
+# Retries of a question killed in its sandbox worker, and seconds of the `Retry-After` of the 503 once they fail
+QUESTION_SANDBOX_RETRIES = int(getenv("QUESTION_SANDBOX_RETRIES", "2"))
+QUESTION_SANDBOX_RETRY_AFTER = int(getenv("QUESTION_SANDBOX_RETRY_AFTER", "1"))
+
+# Seconds between checks of `question_set.json` for changes to hot-reload, 0 to only load it at startup
+QUESTION_SET_RELOAD_INTERVAL = float(getenv("QUESTION_SET_RELOAD_INTERVAL", "5"))
+
+# Question generator
+# Maximum amount of `part` a challenge can request, and the amount of `part` of each tier as `name:parts` pairs
+QUESTION_PARTS_MAX = int(getenv("QUESTION_PARTS_MAX", "1000"))
+QUESTION_TIERS = {
+    name.strip(): int(parts)
+    for name, _, parts in (
+        tier.partition(":") for tier in getenv("QUESTION_TIERS", "easy:0,normal:2,hard:10,chaotic:100").split(",")
+    )
+}
+QUESTION_BIT_BUDGET = int(getenv("QUESTION_BIT_BUDGET", "2048"))
+# Minimum amount of distinct answers after each `part`, a `part` collapsing the answers is replaced, 0 to disable
+QUESTION_MIN_DISTINCT = int(getenv("QUESTION_MIN_DISTINCT", "2"))
+# Maximum predicted microseconds to calculate the answers of a question, from the `cost` of its entries, 0 to disable
+QUESTION_COST_BUDGET = float(getenv("QUESTION_COST_BUDGET", "0"))
+# Evaluate pure int arithmetic validators with numpy for at least this amount of tasks, 0 to disable
+VECTORIZE_MIN_TASKS = int(getenv("QUESTION_VECTORIZE_MIN_TASKS", "256"))
+# Compile the whole chain of validators into one function for at least this amount of tasks, 0 to disable.
+# Compiling cost about 20-40us per step, which only pays back with a few hundred tasks per question
+FUSE_MIN_TASKS = int(getenv("QUESTION_FUSE_MIN_TASKS", "0"))
+# Memory budget in bytes of the memo of validator steps other than plain int arithmetic, 0 to disable
+STEP_MEMO_BYTES = int(getenv("QUESTION_STEP_MEMO_BYTES", "16777216"))
+# Templates taking less than this amount of seconds on average are not memoized, as the lookup would cost more
+STEP_MEMO_MIN_COST = float(getenv("QUESTION_STEP_MEMO_MIN_COST", "0.0000015"))
+# Largest integer the number theory tables are built up to (about 32 bytes each), the helpers fall back to sympy above
+NUMBER_THEORY_LIMIT_MAX = int(getenv("NUMBER_THEORY_LIMIT_MAX", "1048576"))
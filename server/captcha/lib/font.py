@@ -0,0 +1,101 @@
+import threading
+import time
+from collections.abc import Sequence
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from server.captcha.lib.config import FONT_PATH
+from server.captcha.lib.lazy import lazy_import
+from server.captcha.schema.metrics import FontStats
+
+if TYPE_CHECKING:
+    from PIL import ImageFont
+else:
+    ImageFont = lazy_import("PIL.ImageFont")
+
+type Font = ImageFont.FreeTypeFont | ImageFont.ImageFont
+
+DEFAULT_FONT_SIZE = 12
+# Tried in order, Pillow's default font is used if none of them can be loaded
+FONT_CANDIDATES: tuple[str | Path, ...] = (FONT_PATH, "arial.ttf")
+
+
+class FontRegistry:
+    """The fonts of the rendered questions, with the fallback chain resolved once and each size loaded once.
+
+    The fonts are shared by every render thread, they are never modified after loading,
+    and only the loading of a missing size is done under the lock.
+    """
+
+    def __init__(self, candidates: Sequence[str | Path]) -> None:
+        self.candidates: tuple[str | Path, ...] = tuple(candidates)
+        # the first candidate which can be loaded, `None` for the default font
+        self.path: str | Path | None = None
+        self.loads: int = 0
+        self.load_seconds: float = 0.0
+        self.hits: int = 0
+        self._resolved: bool = False
+        self._fonts: dict[tuple[str | Path | None, int], Font] = {}
+        self._lock: threading.Lock = threading.Lock()
+
+    def _load(self, path: str | Path | None, size: int) -> Font:
+        start = time.perf_counter()
+        try:
+            return ImageFont.load_default() if path is None else ImageFont.truetype(path, size)
+        finally:
+            self.loads += 1
+            self.load_seconds += time.perf_counter() - start
+
+    def resolve(self, size: int = DEFAULT_FONT_SIZE) -> None:
+        """Find the first candidate which can be loaded, such as in the background at startup.
+
+        This is blocking, run it in a worker thread from the event loop.
+        """
+        with self._lock:
+            if self._resolved:
+                return
+            for path in self.candidates:
+                try:
+                    self._fonts[path, size] = self._load(path, size)
+                except OSError:
+                    continue
+                self.path = path
+                break
+            self._resolved = True
+
+    def get(self, size: int) -> Font:
+        """Get the font of `size`, loading it on first use.
+
+        Returns:
+            Font: The font of the resolved path, or Pillow's default font.
+
+        """
+        if not self._resolved:
+            self.resolve(size)
+        key = (self.path, size)
+        if (font := self._fonts.get(key)) is not None:
+            self.hits += 1
+            return font
+        with self._lock:
+            if key not in self._fonts:
+                self._fonts[key] = self._load(self.path, size)
+            return self._fonts[key]
+
+    def stats(self) -> FontStats:
+        """Get the statistic of the font loading.
+
+        Returns:
+            FontStats: The statistic of the fonts.
+
+        """
+        return FontStats(
+            path=None if self.path is None else str(self.path),
+            resolved=self._resolved,
+            sizes=len(self._fonts),
+            loads=self.loads,
+            load_seconds=self.load_seconds,
+            hits=self.hits,
+        )
+
+
+FONTS = FontRegistry(FONT_CANDIDATES)
@@ -0,0 +1,119 @@
+import ast
+import re
+from collections.abc import Callable, Mapping, Sequence
+from functools import cache
+from typing import Any
+
+from server.captcha.lib.memo import STEP_MEMO
+from server.captcha.lib.validator import SAFE_GLOBALS, compile_validator, parametrize
+from server.captcha.lib.vectorize import compile_vector_validator
+from server.captcha.schema.questions import Part
+
+SLOT_NAME_COMPILED = re.compile(r"\b_slot(\d+)\b")
+
+
+class GrowthGuardError(Exception):
+    """The answer of a step in the fused chain exceeded the bit budget."""
+
+    def __init__(self, step: int) -> None:
+        super().__init__(f"Step {step} exceeded the bit budget")
+        self.step: int = step
+
+
+class InlineValidator:
+    """The body of a validator lambda, which can be pasted into a fused chain with the values as constants."""
+
+    __slots__ = ("body", "imports", "slots")
+
+    def __init__(self, slots: tuple[str, ...], body: str, imports: dict[str, Any]) -> None:
+        self.slots: tuple[str, ...] = slots
+        self.body: str = body
+        self.imports: dict[str, Any] = imports
+
+    def fill(self, values: Mapping[str, int]) -> str:
+        """Get the expression of the validator with the placeholders replaced by `values`.
+
+        Returns:
+            str: The python expression.
+
+        """
+        params = [values[key] for key in self.slots]
+        # negative values are parenthesized to keep the meaning of a variable, such as `{y}**2`
+        return SLOT_NAME_COMPILED.sub(
+            lambda match: f"({value})" if (value := params[int(match.group(1))]) < 0 else f"{value}",
+            self.body,
+        )
+
+
+@cache
+def compile_inline_validator(template: str) -> InlineValidator | None:
+    """Extract the lambda body of a validator template so it can be inlined into a fused chain.
+
+    Returns:
+        InlineValidator | None: The inlinable validator, `None` if it is not in the form of `validator=lambda x: ...`
+            after any import.
+
+    """
+    if (parametrized := parametrize(template)) is None:
+        return None
+    slots, source = parametrized
+    try:
+        body = ast.parse(source).body
+    except SyntaxError:
+        return None
+    match body:
+        case [
+            *imports,
+            ast.Assign(targets=[ast.Name(id="validator")], value=ast.Lambda(args=args, body=expr)),
+        ] if all(isinstance(stmt, ast.Import | ast.ImportFrom) for stmt in imports):
+            if [arg.arg for arg in args.args] != ["x"] or args.vararg or args.kwarg or args.kwonlyargs:
+                return None
+            imported: dict[str, Any] = {}
+            import_globals = {"__builtins__": SAFE_GLOBALS["__builtins__"]}
+            exec(compile(ast.Module(body=imports, type_ignores=[]), template, "exec"), import_globals, imported)  # noqa: S102 only the import statements of the template
+            return InlineValidator(slots, f"({ast.get_source_segment(source, expr)})", imported)
+    return None
+
+
+def fuse_chain(
+    steps: Sequence[tuple[Part, Mapping[str, int]]],
+    bit_budget: int,
+    guard_from: int = 1,
+) -> Callable[[int], int]:
+    """Compose the validators of a question into a single function, with the values inlined as constants.
+
+    Steps that cannot be inlined are called as their bound validator,
+    and so are the steps other than plain int arithmetic memoized by `STEP_MEMO`, through the memo.
+
+    Args:
+        steps: The `base` or `part` of each step, with the values of its placeholders.
+        bit_budget: The maximum bit length of the answer after each step from `guard_from`.
+        guard_from: The first step to check against `bit_budget`.
+
+    Returns:
+        Callable[[int], int]: The function calculating the answer of a task,
+            which raises `GrowthGuardError` if any step exceeds `bit_budget`.
+
+    """
+    namespace: dict[str, Any] = {**SAFE_GLOBALS, "_GrowthGuardError": GrowthGuardError, "_limit": 1 << bit_budget}
+    lines = ["def _chain(x):"]
+    for step, (entry, values) in enumerate(steps):
+        inline = compile_inline_validator(entry.validator)
+        memoize = compile_vector_validator(entry.validator) is None and STEP_MEMO.memoizes(entry.validator)
+        if (
+            inline is not None
+            and not memoize
+            and all(namespace.get(name, obj) is obj for name, obj in inline.imports.items())
+        ):
+            namespace.update(inline.imports)
+            lines.append(f"    x = {inline.fill(values)}")
+        else:
+            factory = compile_validator(entry.validator)
+            fn = factory.bind(values)
+            namespace[f"_step{step}"] = STEP_MEMO.wrap(factory, values, fn) if memoize else fn
+            lines.append(f"    x = _step{step}(x)")
+        if step >= guard_from:
+            lines.append(f"    if not -_limit < x < _limit: raise _GrowthGuardError({step})")
+    lines.append("    return x")
+    exec(compile("\n".join(lines), "<fused chain>", "exec"), namespace)  # noqa: S102 it run limited subset of questions in question_part.json
+    return namespace["_chain"]
@@ -0,0 +1,48 @@
+import importlib
+import importlib.util
+import sys
+from types import ModuleType
+from typing import Any
+
+# The heavy dependencies, imported on first use or by `preload` once the server is up
+HEAVY_MODULES = ("numpy", "sympy", "PIL.Image", "PIL.ImageDraw", "PIL.ImageFont")
+
+
+class LazyModule(ModuleType):
+    """A placeholder importing its module on the first attribute access, then exposing its attributes.
+
+    The import goes through `importlib.import_module`, so threads using it during the import wait for the module
+    lock instead of seeing a partially initialized module, unlike `importlib.util.LazyLoader`.
+    """
+
+    def __getattr__(self, name: str) -> Any:  # noqa: ANN401
+        module = importlib.import_module(self.__name__)
+        # copied once, so the next accesses are plain attribute lookups
+        self.__dict__.update(module.__dict__)
+        return getattr(module, name)
+
+
+def lazy_import(name: str) -> ModuleType:
+    """Import `name` on its first use instead of now, keeping it out of the startup time.
+
+    Returns:
+        ModuleType: The module if it is already imported, otherwise a placeholder importing it when it is used.
+
+    Raises:
+        ModuleNotFoundError: If the module does not exist.
+
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    if importlib.util.find_spec(name) is None:
+        raise ModuleNotFoundError(f"No module named {name!r}", name=name)
+    return LazyModule(name)
+
+
+def preload(names: tuple[str, ...] = HEAVY_MODULES) -> None:
+    """Import the modules now, so the first request using them does not pay for it.
+
+    This is blocking, run it in a worker thread from the event loop.
+    """
+    for name in names:
+        importlib.import_module(name)
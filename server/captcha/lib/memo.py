@@ -0,0 +1,124 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable, Mapping
+from typing import Any
+
+from server.captcha.lib.config import STEP_MEMO_BYTES, STEP_MEMO_MIN_COST
+from server.captcha.lib.validator import ValidatorFactory
+from server.captcha.schema.metrics import StepMemoStats
+
+type MemoKey = tuple[str, tuple[int, ...], int]
+
+# Rough size of the dict slot, the linked list node of `OrderedDict` and the key tuple of an entry
+ENTRY_OVERHEAD = 200
+# Amount of calls measured before a template is judged too cheap to memoize
+COST_SAMPLES = 8
+_MISSING = object()
+
+
+class StepMemo:
+    """LRU memo of the answer of a validator step, keyed on the template, the bound values and the input.
+
+    Tasks are drawn from the fixed `input` range of a `base`, so the same step is applied to the same input across
+    many challenges. Entries are evicted from the least recently used once their estimated size exceed `budget` bytes.
+
+    The lookup cost about as much as a cheap validator, so the time of each miss is measured per template,
+    and templates taking less than `min_cost` seconds on average are no longer memoized.
+    """
+
+    def __init__(self, budget: int, min_cost: float = 0.0) -> None:
+        self.budget: int = budget
+        self.min_cost: float = min_cost
+        self.bytes: int = 0
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+        self._entries: OrderedDict[MemoKey, tuple[Any, int]] = OrderedDict()
+        # average seconds of a miss, and the amount of misses measured, by template
+        self._costs: dict[str, tuple[float, int]] = {}
+        self._lock: threading.Lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def memoizes(self, template: str) -> bool:
+        """Check whether the steps of `template` should go through the memo.
+
+        Returns:
+            bool: `False` if the memo is disabled, or the template is measured to be cheaper than the lookup.
+
+        """
+        cost, samples = self._costs.get(template, (0.0, 0))
+        return self.budget > 0 and (samples < COST_SAMPLES or cost >= self.min_cost)
+
+    def wrap(
+        self,
+        factory: ValidatorFactory,
+        values: Mapping[str, int],
+        fn: Callable[[int], int],
+    ) -> Callable[[int], int]:
+        """Memoize `fn`, the validator of `factory` bound with `values`.
+
+        Returns:
+            Callable[[int], int]: The memoized validator, or `fn` itself if the template is too cheap to memoize.
+
+        """
+        template = factory.template
+        if not self.memoizes(template):
+            return fn
+        params = tuple(values[key] for key in factory.slots)
+
+        def memoized(x: int) -> int:
+            key = (template, params, x)
+            with self._lock:
+                entry = self._entries.get(key, _MISSING)
+                if entry is not _MISSING:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[0]
+                self.misses += 1
+            start = time.perf_counter()
+            result = fn(x)
+            self._store(key, result, time.perf_counter() - start)
+            return result
+
+        return memoized
+
+    def _store(self, key: MemoKey, result: Any, cost: float) -> None:  # noqa: ANN401
+        template, params, x = key
+        size = ENTRY_OVERHEAD + sys.getsizeof(params) + sys.getsizeof(x) + sys.getsizeof(result)
+        size += sum(map(sys.getsizeof, params))
+        with self._lock:
+            average, samples = self._costs.get(template, (0.0, 0))
+            self._costs[template] = ((average * samples + cost) / (samples + 1), samples + 1)
+            if key in self._entries or size > self.budget:  # stored by another thread in the meantime, or too large
+                return
+            self._entries[key] = (result, size)
+            self.bytes += size
+            while self.bytes > self.budget:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+
+    def stats(self) -> StepMemoStats:
+        """Get the current statistic of the memo.
+
+        Returns:
+            StepMemoStats: The statistic of the memo.
+
+        """
+        lookups = self.hits + self.misses
+        return StepMemoStats(
+            budget=self.budget,
+            bytes=self.bytes,
+            entries=len(self._entries),
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+            hit_rate=self.hits / lookups if lookups else 0.0,
+        )
+
+
+STEP_MEMO = StepMemo(STEP_MEMO_BYTES, STEP_MEMO_MIN_COST)
@@ -0,0 +1,93 @@
+import time
+from collections import Counter, deque
+
+from server.captcha.schema.metrics import ConstructStats, GeneratorStats
+from server.captcha.schema.questions import GeneratedQuestion
+
+
+def percentile(sorted_values: list[float], fraction: float) -> float:
+    """Get the value at `fraction` of the sorted values, by the nearest rank.
+
+    Returns:
+        float: The percentile, 0 if there is no value.
+
+    """
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+class RateMeter:
+    """Count events in a sliding time window to report a rate per second."""
+
+    def __init__(self, window: float = 60.0) -> None:
+        self.window: float = window
+        self.total: int = 0
+        self._events: deque[float] = deque()
+
+    def _expire(self, now: float) -> None:
+        while self._events and self._events[0] < now - self.window:
+            self._events.popleft()
+
+    def record(self, amount: int = 1) -> None:
+        """Record `amount` events happening now."""
+        now = time.monotonic()
+        self._expire(now)
+        self._events.extend([now] * amount)
+        self.total += amount
+
+    def rate(self) -> float:
+        """Get the average events per second in the window.
+
+        Returns:
+            float: The rate per second.
+
+        """
+        self._expire(time.monotonic())
+        return len(self._events) / self.window
+
+
+class GeneratorMetrics:
+    """Statistic of `question_generator`, collected from the generated questions.
+
+    The statistic is carried by `GeneratedQuestion` so questions generated in worker processes are counted as well.
+    """
+
+    def __init__(self) -> None:
+        self.generated: int = 0
+        self.growth_guard: Counter[str] = Counter()
+        self.construct_generated: Counter[str] = Counter()
+        # questions with at least one `part` replaced for collapsing the answers, and the ones still collapsed
+        self.construct_collapsing: Counter[str] = Counter()
+        self.construct_collapsed: Counter[str] = Counter()
+
+    def record(self, question: GeneratedQuestion) -> None:
+        """Record the statistic of a generated question."""
+        self.generated += 1
+        self.growth_guard.update(question.rejected_parts)
+        self.construct_generated[question.construct] += 1
+        self.construct_collapsing[question.construct] += question.collapses > 0
+        self.construct_collapsed[question.construct] += question.collapsed
+
+    def stats(self) -> GeneratorStats:
+        """Get the statistic of the question generator.
+
+        Returns:
+            GeneratorStats: The statistic of the question generator.
+
+        """
+        return GeneratorStats(
+            generated=self.generated,
+            growth_guard=dict(self.growth_guard.most_common()),
+            constructs={
+                construct: ConstructStats(
+                    generated=generated,
+                    collapse_rate=self.construct_collapsing[construct] / generated,
+                    collapsed=self.construct_collapsed[construct],
+                )
+                for construct, generated in self.construct_generated.items()
+            },
+        )
+
+
+GENERATOR_METRICS = GeneratorMetrics()
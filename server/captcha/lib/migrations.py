@@ -0,0 +1,32 @@
+import logging
+
+from sqlalchemy import Connection, Table, inspect, text
+from sqlalchemy.schema import CreateColumn
+
+LOGGER = logging.getLogger("app")
+
+
+def add_missing_columns(connection: Connection, table: Table) -> list[str]:
+    """Add the columns of `table` missing from an existing table of the database.
+
+    `create_all` only creates the missing tables, so the columns added to a model since the database was created are
+    added here. Each of them must be nullable or have a `server_default`, for the rows already in the table.
+
+    Returns:
+        list[str]: The name of the added columns.
+
+    """
+    inspector = inspect(connection)
+    if not inspector.has_table(table.name):
+        return []
+    existing = {column["name"] for column in inspector.get_columns(table.name)}
+    table_name = connection.dialect.identifier_preparer.format_table(table)
+    added: list[str] = []
+    for column in table.columns:
+        if column.name in existing:
+            continue
+        definition = CreateColumn(column).compile(dialect=connection.dialect)
+        connection.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {definition}"))
+        LOGGER.info("Added column %s to table %s", column.name, table.name)
+        added.append(column.name)
+    return added
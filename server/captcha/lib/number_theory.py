@@ -0,0 +1,298 @@
+import builtins
+import math
+import time
+from pathlib import Path
+from types import ModuleType
+from typing import TYPE_CHECKING, Any
+
+from server.captcha.lib.config import NUMBER_THEORY_LIMIT_MAX
+from server.captcha.lib.lazy import lazy_import
+from server.captcha.schema.questions import QuestionSet
+
+if TYPE_CHECKING:
+    import numpy as np
+    import sympy
+else:
+    # numpy is only needed once the tables are loaded, and sympy only when a helper falls back to it
+    np = lazy_import("numpy")
+    sympy = lazy_import("sympy")
+
+TABLE_NAMES = ("smallest_prime_factor", "primes", "previous_prime", "divisor_count")
+# Seconds between the checks of a helper falling back to sympy for tables saved since the last load
+TABLE_RELOAD_INTERVAL = 1.0
+FIBONACCI = [0, 1]
+while len(FIBONACCI) <= 1000:  # noqa: PLR2004
+    FIBONACCI.append(FIBONACCI[-1] + FIBONACCI[-2])
+
+
+class NumberTheoryTable:
+    """Array-backed number theory tables for every integer up to `limit`.
+
+    The arrays are stored as `.npy` files and memory-mapped, so several workers share one copy in the page cache.
+    """
+
+    def __init__(self, arrays: "dict[str, np.ndarray]", directory: Path | None = None) -> None:
+        self.directory: Path | None = directory
+        self.smallest_prime_factor: np.ndarray = arrays["smallest_prime_factor"]
+        self.primes: np.ndarray = arrays["primes"]
+        self.previous_prime: np.ndarray = arrays["previous_prime"]
+        self.divisor_count: np.ndarray = arrays["divisor_count"]
+        self.limit: int = len(self.smallest_prime_factor) - 1
+
+    @classmethod
+    def build(cls, limit: int) -> "NumberTheoryTable":
+        """Sieve the tables up to `limit`.
+
+        Returns:
+            NumberTheoryTable: The tables.
+
+        """
+        numbers = np.arange(limit + 1, dtype=np.int64)
+        smallest_prime_factor = np.zeros(limit + 1, dtype=np.int64)
+        for i in range(2, math.isqrt(limit) + 1):
+            if smallest_prime_factor[i] == 0:
+                multiples = smallest_prime_factor[i * i :: i]
+                multiples[multiples == 0] = i
+        unset = smallest_prime_factor == 0
+        smallest_prime_factor[unset] = numbers[unset]
+        is_prime = (smallest_prime_factor == numbers) & (numbers >= 2)  # noqa: PLR2004
+        # largest prime that is at most n, shifted by one to be strictly less than n
+        previous_prime = np.zeros(limit + 1, dtype=np.int64)
+        previous_prime[1:] = np.maximum.accumulate(np.where(is_prime, numbers, 0))[:-1]
+        divisor_count = np.zeros(limit + 1, dtype=np.int64)
+        for i in range(1, limit + 1):
+            divisor_count[i::i] += 1
+        return cls(
+            {
+                "smallest_prime_factor": smallest_prime_factor,
+                "primes": np.flatnonzero(is_prime),
+                "previous_prime": previous_prime,
+                "divisor_count": divisor_count,
+            },
+        )
+
+    @classmethod
+    def load(cls, directory: Path) -> "NumberTheoryTable":
+        """Memory-map the tables saved in `directory`.
+
+        Returns:
+            NumberTheoryTable: The tables.
+
+        """
+        # plain ndarray views of the memory maps, indexing `np.memmap` is a few times slower
+        return cls(
+            {name: np.asarray(np.load(directory / f"{name}.npy", mmap_mode="r")) for name in TABLE_NAMES},
+            directory,
+        )
+
+    def save(self, directory: Path) -> None:
+        """Save the tables to `directory`, replacing each file atomically for the workers reading it."""
+        directory.mkdir(parents=True, exist_ok=True)
+        for name in TABLE_NAMES:
+            temp_path = directory / f"{name}.tmp.npy"
+            np.save(temp_path, getattr(self, name))
+            temp_path.replace(directory / f"{name}.npy")
+
+    def divisors(self, n: int) -> list[int]:
+        """Get the sorted divisors of `n` from its factorization by the smallest prime factor table.
+
+        Returns:
+            list[int]: The divisors of `n`.
+
+        """
+        result = [1]
+        while n > 1:
+            factor = int(self.smallest_prime_factor[n])
+            size = len(result)
+            power = 1
+            while n % factor == 0:
+                n //= factor
+                power *= factor
+                result.extend([divisor * power for divisor in result[:size]])
+        result.sort()
+        return result
+
+
+_table: NumberTheoryTable | None = None
+# where the tables are saved, and when a helper last checked it for tables saved since
+_table_directory: Path | None = None
+_table_checked: float = 0.0
+
+
+def required_limit(question_set: QuestionSet) -> int:
+    """Get the largest magnitude of the `range` and `input` declared in the question set, up to the maximum.
+
+    Returns:
+        int: The limit the tables need to cover, at most `NUMBER_THEORY_LIMIT_MAX`.
+
+    """
+    bounds: list[int] = []
+    for entry in (*question_set.base, *question_set.part):
+        for value_range in entry.range.values():
+            bounds.extend(value_range)
+        bounds.extend(getattr(entry, "input", ()))
+    return min(max(map(abs, bounds), default=0), NUMBER_THEORY_LIMIT_MAX)
+
+
+def load_table(directory: Path) -> NumberTheoryTable | None:
+    """Use the tables saved in `directory` for the helpers if they exist, such as in a worker process.
+
+    Until then, and until they cover the maximum, the helpers falling back to sympy check `directory` again,
+    as the workers can start before the warm-up saves the tables.
+
+    Returns:
+        NumberTheoryTable | None: The loaded tables.
+
+    """
+    global _table, _table_directory  # noqa: PLW0603
+    _table_directory = directory
+    if all((directory / f"{name}.npy").exists() for name in TABLE_NAMES):
+        _table = NumberTheoryTable.load(directory)
+    return _table
+
+
+def ensure_table(directory: Path, limit: int) -> NumberTheoryTable:
+    """Use the tables saved in `directory` for the helpers, building them first if they do not cover `limit`.
+
+    Returns:
+        NumberTheoryTable: The loaded tables.
+
+    """
+    global _table  # noqa: PLW0603
+    table = load_table(directory)
+    if table is None or table.limit < limit:
+        NumberTheoryTable.build(limit).save(directory)
+        table = _table = NumberTheoryTable.load(directory)
+    return table
+
+
+def _reload() -> bool:
+    global _table_checked  # noqa: PLW0603
+    if _table_directory is None or (_table is not None and _table.limit >= NUMBER_THEORY_LIMIT_MAX):
+        return False
+    now = time.monotonic()
+    if now - _table_checked < TABLE_RELOAD_INTERVAL:
+        return False
+    _table_checked = now
+    previous = _table
+    try:
+        table = load_table(_table_directory)
+    except (OSError, ValueError):
+        # a table replaced while it is read, the next check loads it
+        return False
+    return table is not None and (previous is None or table.limit > previous.limit)
+
+
+def current_table() -> NumberTheoryTable | None:
+    """Get the tables used by the helpers.
+
+    Returns:
+        NumberTheoryTable | None: The tables, `None` if the helpers always fall back to sympy.
+
+    """
+    return _table
+
+
+def _in_table(n: Any, low: int, high: int) -> bool:  # noqa: ANN401
+    return type(n) is int and low <= n <= high
+
+
+def prime(n: int) -> int:
+    """Get the `n`-th prime, the table-backed `sympy.prime`.
+
+    Returns:
+        int: The `n`-th prime.
+
+    """
+    if _table is not None and _in_table(n, 1, len(_table.primes)):
+        return int(_table.primes[n - 1])
+    if _reload():
+        return prime(n)
+    return sympy.prime(n)
+
+
+def prevprime(n: int) -> int:
+    """Get the largest prime smaller than `n`, the table-backed `sympy.prevprime`.
+
+    Returns:
+        int: The largest prime smaller than `n`.
+
+    """
+    if _table is not None and _in_table(n, 3, _table.limit):
+        return int(_table.previous_prime[n])
+    if _reload():
+        return prevprime(n)
+    return sympy.prevprime(n)
+
+
+def divisors(n: int) -> list[int]:
+    """Get the sorted divisors of `abs(n)`, the table-backed `sympy.divisors`.
+
+    Returns:
+        list[int]: The divisors of `n`.
+
+    """
+    if _table is not None and _in_table(n, -_table.limit, _table.limit) and n != 0:
+        return _table.divisors(abs(n))
+    if _reload():
+        return divisors(n)
+    return sympy.divisors(n)
+
+
+def divisor_count(n: int) -> int:
+    """Get the number of divisors of `abs(n)`, the table-backed `sympy.divisor_count`.
+
+    Returns:
+        int: The number of divisors of `n`.
+
+    """
+    if _table is not None and _in_table(n, -_table.limit, _table.limit) and n != 0:
+        return int(_table.divisor_count[abs(n)])
+    if _reload():
+        return divisor_count(n)
+    return sympy.divisor_count(n)
+
+
+def fibonacci(n: int) -> int:
+    """Get the `n`-th fibonacci number, the table-backed `sympy.fibonacci`.
+
+    Returns:
+        int: The `n`-th fibonacci number.
+
+    """
+    if _in_table(n, 0, len(FIBONACCI) - 1):
+        return FIBONACCI[n]
+    return sympy.fibonacci(n)
+
+
+class _TableSympy(ModuleType):
+    """`sympy` with the table-backed helpers, for validators importing them from sympy."""
+
+    def __getattr__(self, name: str) -> Any:  # noqa: ANN401
+        return getattr(sympy, name)
+
+
+TABLE_SYMPY = _TableSympy("sympy")
+TABLE_SYMPY.prime = prime
+TABLE_SYMPY.prevprime = prevprime
+TABLE_SYMPY.divisors = divisors
+TABLE_SYMPY.divisor_count = divisor_count
+TABLE_SYMPY.fibonacci = fibonacci
+
+
+def table_import(
+    name: str,
+    globals: dict[str, Any] | None = None,
+    locals: dict[str, Any] | None = None,
+    fromlist: tuple[str, ...] = (),
+    level: int = 0,
+) -> ModuleType:
+    """`__import__` which resolves `sympy` to `TABLE_SYMPY`.
+
+    Returns:
+        ModuleType: The imported module.
+
+    """
+    if name == "sympy" and level == 0:
+        return TABLE_SYMPY
+    return builtins.__import__(name, globals, locals, fromlist, level)
@@ -0,0 +1,204 @@
+import asyncio
+import contextlib
+import logging
+import multiprocessing
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Literal
+
+from server.captcha.lib.config import (
+    QUESTION_SANDBOX_CPU_SECONDS,
+    QUESTION_SANDBOX_MEMORY_BYTES,
+    QUESTION_SANDBOX_RETRIES,
+    QUESTION_SANDBOX_TIMEOUT,
+)
+from server.captcha.lib.metrics import GENERATOR_METRICS, RateMeter
+from server.captcha.lib.number_theory import load_table
+from server.captcha.lib.question_store import QuestionStore
+from server.captcha.lib.sandbox import SandboxError, SandboxExecutor
+from server.captcha.lib.utils import question_generator
+from server.captcha.schema.metrics import QuestionPoolStats
+from server.captcha.schema.questions import GeneratedQuestion
+
+LOGGER = logging.getLogger("app")
+
+type ExecutorKind = Literal["thread", "process", "sandbox"]
+
+
+class QuestionPool:
+    """A pool of pre-generated questions, refilled in the background by worker threads or processes.
+
+    `get` pops a ready question in O(1), and only generate the question on the workers if the pool is empty.
+    Questions of a requested amount of parts are not pooled, and are always generated on the workers.
+    With the `sandbox` executor, questions are generated in resource-limited processes,
+    so a hanging question never runs in the web process.
+    Questions are tagged with the version of the question set they are generated from,
+    and the ones of a previous version are dropped once the store is reloaded.
+    """
+
+    def __init__(
+        self,
+        store: QuestionStore,
+        size: int,
+        workers: int = 2,
+        executor: ExecutorKind = "thread",
+    ) -> None:
+        self.store: QuestionStore = store
+        self.size: int = size
+        self.workers: int = max(1, workers)
+        self.executor_kind: ExecutorKind = executor
+        self.hits: int = 0
+        self.misses: int = 0
+        self.refill_meter: RateMeter = RateMeter()
+        self._questions: deque[GeneratedQuestion] = deque()
+        self._low: asyncio.Event = asyncio.Event()
+        self._executor: Executor | None = None
+        self._task: asyncio.Task[None] | None = None
+
+    def __len__(self) -> int:
+        return len(self._questions)
+
+    async def start(self) -> None:
+        """Start the workers, and refilling the pool in the background."""
+        if self._executor is not None:
+            return
+        # the workers load the tables if they are saved, otherwise once the warm-up saves them, on a helper miss
+        table_directory = self.store.table_directory
+        if self.executor_kind == "process":
+            # not forked from the web process, which already runs threads
+            start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context(start_method),
+                initializer=load_table,
+                initargs=(table_directory,),
+            )
+        elif self.executor_kind == "sandbox":
+            self._executor = SandboxExecutor(
+                max_workers=self.workers,
+                timeout=QUESTION_SANDBOX_TIMEOUT,
+                cpu_seconds=QUESTION_SANDBOX_CPU_SECONDS,
+                memory_bytes=QUESTION_SANDBOX_MEMORY_BYTES,
+                table_directory=table_directory,
+            )
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="question-pool")
+        if self.size <= 0:
+            return
+        self._low.set()
+        self._task = asyncio.create_task(self._refill(), name="question-pool-refill")
+
+    async def stop(self) -> None:
+        """Stop the background refill and the workers."""
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def _pop(self) -> GeneratedQuestion | None:
+        while self._questions:
+            question = self._questions.popleft()
+            if question.version == self.store.version:
+                self.hits += 1
+                return question
+        return None
+
+    def _tag(self, question: GeneratedQuestion, version: int) -> GeneratedQuestion:
+        question.version = version
+        GENERATOR_METRICS.record(question)
+        return question
+
+    async def get(self, parts: int | None = None) -> GeneratedQuestion:
+        """Get a question from the pool, or generate one on the workers if the pool is empty.
+
+        Returns:
+            GeneratedQuestion: A newly generated question, of `parts` parts if given.
+
+        """
+        return (await self.get_many(1, parts))[0]
+
+    async def get_many(self, amount: int, parts: int | None = None) -> list[GeneratedQuestion]:
+        """Get `amount` questions, taking the ready ones from the pool and generating the rest on the workers.
+
+        The questions killed in their sandbox worker are generated again, up to `QUESTION_SANDBOX_RETRIES` times.
+
+        Returns:
+            list[GeneratedQuestion]: The newly generated questions, of `parts` parts if given.
+
+        Raises:
+            SandboxError: If a question is still killed in its sandbox worker after the retries.
+
+        """
+        questions: list[GeneratedQuestion] = []
+        if parts is None:
+            self._low.set()
+            while len(questions) < amount and (question := self._pop()) is not None:
+                questions.append(question)
+            self.misses += amount - len(questions)
+        missing = amount - len(questions)
+        if missing > 0:
+            loop = asyncio.get_running_loop()
+            version = self.store.version
+            generate = partial(question_generator, parts=parts, version=version)
+            question_set = self.store.current
+            for retry in range(QUESTION_SANDBOX_RETRIES + 1):
+                jobs = [loop.run_in_executor(self._executor, generate, question_set) for _ in range(missing)]
+                errors: list[BaseException] = []
+                for result in await asyncio.gather(*jobs, return_exceptions=True):
+                    if isinstance(result, BaseException):
+                        errors.append(result)
+                    else:
+                        questions.append(self._tag(result, version))
+                # only a killed worker is worth another try, any other error is raised as is
+                if error := next((error for error in errors if not isinstance(error, SandboxError)), None):
+                    raise error
+                if not errors:
+                    break
+                if retry == QUESTION_SANDBOX_RETRIES:
+                    raise errors[0]
+                LOGGER.warning("Failed to generate %d question(s), retrying", len(errors), exc_info=errors[0])
+                missing = len(errors)
+        return questions
+
+    def stats(self) -> QuestionPoolStats:
+        """Get the current statistic of the pool.
+
+        Returns:
+            QuestionPoolStats: The statistic of the pool.
+
+        """
+        return QuestionPoolStats(
+            size=self.size,
+            depth=len(self._questions),
+            workers=self.workers,
+            executor=self.executor_kind,
+            hits=self.hits,
+            misses=self.misses,
+            generated=self.refill_meter.total,
+            refill_rate=self.refill_meter.rate(),
+        )
+
+    async def _refill(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._low.wait()
+            self._low.clear()
+            while (missing := self.size - len(self._questions)) > 0:
+                version = self.store.version
+                generate = partial(question_generator, version=version)
+                jobs = [
+                    loop.run_in_executor(self._executor, generate, self.store.current)
+                    for _ in range(min(missing, self.workers))
+                ]
+                for result in await asyncio.gather(*jobs, return_exceptions=True):
+                    if isinstance(result, BaseException):
+                        LOGGER.error("Failed to pre-generate question", exc_info=result)
+                        await asyncio.sleep(1)
+                        continue
+                    self._questions.append(self._tag(result, version))
+                    self.refill_meter.record()
@@ -0,0 +1,152 @@
+import asyncio
+import contextlib
+import logging
+from pathlib import Path
+
+import anyio.to_thread
+from msgspec import DecodeError
+from msgspec.json import decode
+from server.captcha.lib.lazy import preload
+from server.captcha.lib.number_theory import ensure_table, required_limit
+from server.captcha.lib.sampling import get_samplers
+from server.captcha.lib.template import compile_templates
+from server.captcha.lib.validator import compile_question_set
+from server.captcha.schema.questions import QuestionSet
+
+LOGGER = logging.getLogger("app")
+
+
+class QuestionStore:
+    """Versioned question sets loaded from `question_set.json`, reloaded in the background when the file changes.
+
+    Every distinct content of the file get the next version number, and is archived as `<version>.json` in
+    `archive`, so the version stored on a challenge still refer to the same questions after a reload or a restart.
+    Only the current version is kept in memory, the archive is what keeps the previous ones available.
+    """
+
+    def __init__(self, path: Path, archive: Path, table_directory: Path) -> None:
+        self.path: Path = path
+        self.archive: Path = archive
+        self.table_directory: Path = table_directory
+        # swapped as one, so the version and its question set always match
+        self._loaded: tuple[int, QuestionSet | None] = (0, None)
+        self._mtime: int | None = None
+        self._lock: asyncio.Lock = asyncio.Lock()
+        self._task: asyncio.Task[None] | None = None
+        self._warm_up_task: asyncio.Task[None] | None = None
+
+    @property
+    def version(self) -> int:
+        """The version of the current question set, 0 until one is loaded."""
+        return self._loaded[0]
+
+    @property
+    def current(self) -> QuestionSet:
+        """The question set new challenges are generated from.
+
+        Raises:
+            RuntimeError: If no question set is loaded yet.
+
+        """
+        question_set = self._loaded[1]
+        if question_set is None:
+            raise RuntimeError("No question set is loaded yet")
+        return question_set
+
+    def _latest_archived(self) -> int:
+        return max((int(path.stem) for path in self.archive.glob("*.json") if path.stem.isdigit()), default=0)
+
+    def load(self, *, table: bool = True) -> bool:
+        """Validate and precompile `question_set.json`, then make it the current version if its content changed.
+
+        This is blocking, use `reload` from the event loop.
+        With `table=False` the number theory tables are left to `warm_up`, such as for a fast startup.
+
+        Returns:
+            bool: Whether a new version is now current.
+
+        Raises:
+            ValueError: If the file is not a valid question set.
+
+        """
+        # recorded before validating, so an invalid file is only reported once until it is changed again
+        self._mtime = self.path.stat().st_mtime_ns
+        content = self.path.read_bytes()
+        try:
+            question_set = decode(content, type=QuestionSet)
+        except DecodeError as e:
+            raise ValueError(f"Invalid question set {self.path}: {e}") from e
+        compile_question_set(question_set)
+        get_samplers(question_set)
+        compile_templates(question_set)
+        if table:
+            ensure_table(self.table_directory, required_limit(question_set))
+
+        latest = self._latest_archived()
+        if latest and (self.archive / f"{latest}.json").read_bytes() == content:
+            version = latest
+        else:
+            version = latest + 1
+            self.archive.mkdir(parents=True, exist_ok=True)
+            temp_path = self.archive / f"{version}.tmp"
+            temp_path.write_bytes(content)
+            temp_path.replace(self.archive / f"{version}.json")
+        if version == self.version:
+            return False
+        # swapped last, so the version is only visible once it is ready
+        self._loaded = (version, question_set)
+        LOGGER.info("Question set version %d loaded from %s", version, self.path)
+        return True
+
+    async def reload(self) -> bool:
+        """Load `question_set.json` in a worker thread if it changed since the last load.
+
+        Returns:
+            bool: Whether a new version is now current.
+
+        Raises:
+            ValueError: If the file is not a valid question set, the current version is kept.
+
+        """
+        async with self._lock:
+            if self.path.stat().st_mtime_ns == self._mtime:
+                return False
+            return await anyio.to_thread.run_sync(self.load)
+
+    def _warm_up(self) -> None:
+        preload()
+        ensure_table(self.table_directory, required_limit(self.current))
+
+    async def warm_up(self) -> None:
+        """Import the heavy dependencies and load the number theory tables of the current version in a worker thread.
+
+        Until then the helpers fall back to sympy, which is imported on first use.
+        """
+        async with self._lock:
+            await anyio.to_thread.run_sync(self._warm_up)
+
+    async def start(self, interval: float) -> None:
+        """Start the warm-up, and checking `question_set.json` for changes every `interval` seconds, 0 to disable."""
+        if self._warm_up_task is None:
+            self._warm_up_task = asyncio.create_task(self.warm_up(), name="question-set-warm-up")
+        if interval <= 0 or self._task is not None:
+            return
+        self._task = asyncio.create_task(self._watch(interval), name="question-set-watch")
+
+    async def stop(self) -> None:
+        """Stop checking for changes."""
+        for task in (self._warm_up_task, self._task):
+            if task is not None:
+                task.cancel()
+                with contextlib.suppress(asyncio.CancelledError):
+                    await task
+        self._warm_up_task = self._task = None
+
+    async def _watch(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.reload()
+            except Exception:
+                # anything failing in the validation or the precompilation must not stop the watch
+                LOGGER.exception("Failed to reload question set, keeping version %d", self.version)
@@ -0,0 +1,517 @@
+import asyncio
+import bisect
+import multiprocessing
+import sys
+import textwrap
+import threading
+import time
+import zlib
+from collections import OrderedDict, deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import UTC, datetime
+from functools import cache, partial
+from io import BytesIO
+from typing import TYPE_CHECKING, Literal
+from uuid import UUID
+
+from msgspec import Struct
+from server.captcha.lib.atlas import ATLASES
+from server.captcha.lib.config import (
+    CHALLENGE_LIFETIME,
+    RENDER_BACKEND,
+    RENDER_CACHE_BYTES,
+    RENDER_PNG_COLORS,
+    RENDER_PNG_COMPRESS_LEVEL,
+    RENDER_PNG_STRATEGY,
+    RENDER_PRERENDER_WIDTH,
+    RENDER_WIDTHS,
+)
+from server.captcha.lib.font import FONTS
+from server.captcha.lib.lazy import lazy_import
+from server.captcha.lib.metrics import percentile
+from server.captcha.schema.metrics import PrerenderStats, RenderCacheStats, RenderQueueStats, RenderStats
+
+if TYPE_CHECKING:
+    from PIL import Image, ImageDraw
+    from server.captcha.models import Challenge
+else:
+    Image = lazy_import("PIL.Image")
+    ImageDraw = lazy_import("PIL.ImageDraw")
+
+type RenderKey = tuple[UUID, int]
+type ExecutorKind = Literal["thread", "process"]
+type RenderBackend = Literal["pil", "atlas"]
+
+# Amount of latest renders the timing percentiles are computed from
+TIMING_SAMPLES = 1024
+# Amount of prerendered images not fetched yet which are tracked for the hit rate of the prerenders
+PRERENDER_TRACKED = 4096
+# Rough size of the dict slot, the linked list node of `OrderedDict` and the key tuple of an entry
+ENTRY_OVERHEAD = 200
+# zlib strategy of the PNG compression by name
+PNG_STRATEGIES = {
+    "default": zlib.Z_DEFAULT_STRATEGY,
+    "filtered": zlib.Z_FILTERED,
+    "huffman": zlib.Z_HUFFMAN_ONLY,
+    "rle": zlib.Z_RLE,
+    "fixed": zlib.Z_FIXED,
+}
+# Bit depths of a PNG palette
+PNG_BIT_DEPTHS = (1, 2, 4, 8)
+
+
+def bucket_width(width: int) -> int:
+    """Snap a requested width down to one of `RENDER_WIDTHS`, clamped to the smallest and the largest.
+
+    Returns:
+        int: The width to render at.
+
+    """
+    return RENDER_WIDTHS[max(bisect.bisect_right(RENDER_WIDTHS, width) - 1, 0)]
+
+
+def wrap_text(text: str, width: int, font_size: int) -> list[str]:
+    """Wrap the lines of text to the width of the image, keeping the empty lines.
+
+    Returns:
+        list[str]: The lines to draw.
+
+    """
+    wrapped_lines = []
+    character_width = (font_size + 4) // 2
+    for line in text.split("\n"):
+        if line.strip():
+            wrapped = textwrap.fill(line, width=(width - 20) // character_width)
+            wrapped_lines.extend(wrapped.split("\n"))
+        else:
+            wrapped_lines.append("")
+    return wrapped_lines
+
+
+class PngEncoding(Struct, frozen=True):
+    """How the question images are encoded to PNG.
+
+    The text is black on white, so the image is stored as a palette of `colors` grays, at the smallest bit depth of
+    the palette. With 2 colors the glyphs are rasterized in FreeType's monochrome mode, hinted for 1-bit, as
+    thresholding the antialiased glyphs merges the thin strokes, and with 256 colors the image is 8-bit grayscale.
+    """
+
+    colors: int = 2
+    compress_level: int = 6
+    strategy: str = "default"
+
+    @property
+    def antialias(self) -> bool:
+        """Whether the glyphs are antialiased, which needs more than 2 colors."""
+        return self.colors > 2  # noqa: PLR2004
+
+
+PNG_ENCODING = PngEncoding(
+    colors=max(2, min(256, RENDER_PNG_COLORS)),
+    compress_level=RENDER_PNG_COMPRESS_LEVEL,
+    strategy=RENDER_PNG_STRATEGY,
+)
+# Part of the ETag of the images, which changes with the settings changing the images
+RENDER_SETTINGS_TAG = f"{zlib.crc32(repr((RENDER_BACKEND, PNG_ENCODING)).encode()):08x}"
+
+
+@cache
+def _palette(colors: int) -> tuple[list[int], bytes, int]:
+    """Get the lookup table from gray to the index of the nearest of `colors` grays, from white to black.
+
+    Returns:
+        tuple[list[int], bytes, int]: The lookup table, the RGB palette and its bit depth.
+
+    """
+    darkest = colors - 1
+    lookup = [round((255 - value) * darkest / 255) for value in range(256)]
+    palette = bytes(255 - round(index * 255 / darkest) for index in range(colors) for _ in range(3))
+    return lookup, palette, next(bits for bits in PNG_BIT_DEPTHS if 1 << bits >= colors)
+
+
+def _draw_text(
+    lines: list[str],
+    size: tuple[int, int],
+    font_size: int,
+    line_height: int,
+    *,
+    antialias: bool,
+) -> "Image.Image":
+    font = FONTS.get(font_size)
+    img = Image.new("L", size, color=255)
+    draw = ImageDraw.Draw(img)
+    draw.fontmode = "L" if antialias else "1"
+
+    y_position = 10
+    for line in lines:
+        draw.text((10, y_position), line, fill=0, font=font)
+        y_position += line_height
+    return img
+
+
+def draw_text_image(
+    text: str,
+    width: int = 800,
+    font_size: int = 12,
+    backend: RenderBackend = RENDER_BACKEND,
+    *,
+    antialias: bool = True,
+) -> "Image.Image":
+    """Draw text black on white.
+
+    Args:
+        text: The text to draw
+        width: Width of the image
+        font_size: Font size for the text
+        backend: `pil` to draw each line with FreeType, `atlas` to copy the glyphs from a `GlyphAtlas`.
+            The atlas falls back to FreeType if the font is not monospaced, or for a character of another width
+        antialias: Whether to antialias the glyphs, otherwise the image only has black and white pixels
+
+    Returns:
+        Image.Image: The grayscale image.
+
+    """
+    wrapped_lines = wrap_text(text, width, font_size)
+    line_height = font_size + 4
+    size = (width, max(60, len(wrapped_lines) * line_height + 20))
+
+    if backend == "atlas" and (atlas := ATLASES.get(font_size, line_height, antialias=antialias)) is not None:
+        img = atlas.draw(wrapped_lines, size, (10, 10))
+        if img is not None:
+            return img
+    return _draw_text(wrapped_lines, size, font_size, line_height, antialias=antialias)
+
+
+def encode_png(image: "Image.Image", encoding: PngEncoding = PNG_ENCODING) -> bytes:
+    """Encode a grayscale image to PNG.
+
+    Returns:
+        bytes: The PNG image.
+
+    """
+    options = {
+        "compress_level": encoding.compress_level,
+        "compress_type": PNG_STRATEGIES.get(encoding.strategy, zlib.Z_DEFAULT_STRATEGY),
+    }
+    if encoding.colors < 256:  # noqa: PLR2004
+        lookup, palette, options["bits"] = _palette(encoding.colors)
+        image = image.point(lookup)
+        image.putpalette(palette)
+    buffer = BytesIO()
+    image.save(buffer, format="PNG", **options)
+    return buffer.getvalue()
+
+
+def text_to_image(
+    text: str,
+    width: int = 800,
+    font_size: int = 12,
+    backend: RenderBackend = RENDER_BACKEND,
+    encoding: PngEncoding = PNG_ENCODING,
+) -> bytes:
+    """Convert text to PNG image.
+
+    Args:
+        text: The text to convert to image
+        width: Width of the image
+        font_size: Font size for the text
+        backend: How the text is drawn, see `draw_text_image`
+        encoding: How the image is encoded to PNG
+
+    Returns:
+        bytes: The PNG image
+
+    """
+    img = draw_text_image(text, width, font_size, backend, antialias=encoding.antialias)
+    return encode_png(img, encoding)
+
+
+def image_etag(challenge_id: UUID, width: int) -> str:
+    """Get the strong ETag of the question image of a challenge at a bucket width.
+
+    The question of a challenge never changes, so the image only changes with the settings it is rendered with.
+
+    Returns:
+        str: The quoted ETag.
+
+    """
+    return f'"{challenge_id.hex}-{width}-{RENDER_SETTINGS_TAG}"'
+
+
+class RenderCache:
+    """LRU cache of the encoded question images, keyed by challenge and width, bounded by their total size.
+
+    Clients reload, resize and retry, each of which would render the same question again.
+    An entry expires with its challenge, and entries are evicted from the least recently used once their size exceed
+    `budget` bytes.
+    """
+
+    def __init__(self, budget: int) -> None:
+        self.budget: int = budget
+        self.bytes: int = 0
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+        self.expired: int = 0
+        # the image, its size, and the `time.monotonic` it expires at
+        self._entries: OrderedDict[RenderKey, tuple[bytes, int, float]] = OrderedDict()
+        self._lock: threading.Lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _remove(self, key: RenderKey) -> None:
+        _, size, _ = self._entries.pop(key)
+        self.bytes -= size
+
+    def get(self, key: RenderKey) -> bytes | None:
+        """Get a cached image.
+
+        Returns:
+            bytes | None: The image, `None` if it is not cached or expired.
+
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] <= time.monotonic():
+                self._remove(key)
+                self.expired += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: RenderKey, image: bytes, ttl: float) -> None:
+        """Cache an image for `ttl` seconds."""
+        size = ENTRY_OVERHEAD + sys.getsizeof(image)
+        if ttl <= 0 or size > self.budget:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (image, size, now + ttl)
+            self.bytes += size
+            # the least recently used are also the most likely to be expired
+            while self._entries and (self.bytes > self.budget or next(iter(self._entries.values()))[2] <= now):
+                oldest, (_, _, expires) = next(iter(self._entries.items()))
+                self._remove(oldest)
+                if expires <= now:
+                    self.expired += 1
+                else:
+                    self.evictions += 1
+
+    def stats(self) -> RenderCacheStats:
+        """Get the current statistic of the cache.
+
+        Returns:
+            RenderCacheStats: The statistic of the cache.
+
+        """
+        lookups = self.hits + self.misses
+        return RenderCacheStats(
+            budget=self.budget,
+            bytes=self.bytes,
+            entries=len(self._entries),
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+            expired=self.expired,
+            hit_rate=self.hits / lookups if lookups else 0.0,
+        )
+
+
+RENDER_CACHE = RenderCache(RENDER_CACHE_BYTES)
+
+
+class RenderQueueFullError(Exception):
+    """Every render worker is busy and the queue of waiting renders is full."""
+
+
+def _render_job(text: str, width: int) -> tuple[bytes, float, float]:
+    """Render on a worker, with the `time.monotonic` it started at, which is system-wide across processes.
+
+    Returns:
+        tuple[bytes, float, float]: The image, the time the render started at, and the seconds it took.
+
+    """
+    started = time.monotonic()
+    image = text_to_image(text, width=width)
+    return image, started, time.monotonic() - started
+
+
+class Renderer:
+    """Render the question images on thread or process workers, out of the event loop, behind a bounded queue.
+
+    At most `workers + queue_size` renders are in flight, a render beyond raises `RenderQueueFullError` right away,
+    so a burst is turned away instead of piling up. Concurrent requests of the same challenge and width share a
+    single render, and every image is kept in `cache`.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        queue_size: int,
+        executor: ExecutorKind = "thread",
+        cache: RenderCache = RENDER_CACHE,
+    ) -> None:
+        self.workers: int = max(1, workers)
+        self.queue_size: int = max(0, queue_size)
+        self.executor_kind: ExecutorKind = executor
+        self.cache: RenderCache = cache
+        self.rendered: int = 0
+        self.rejected: int = 0
+        self._executor: Executor | None = None
+        self._pending: dict[RenderKey, asyncio.Future[tuple[bytes, float, float]]] = {}
+        # seconds waiting in the queue and rendering, of the latest renders
+        self._timings: deque[tuple[float, float]] = deque(maxlen=TIMING_SAMPLES)
+        self.prerender_scheduled: int = 0
+        self.prerender_skipped: int = 0
+        self.prerendered: int = 0
+        self.prerender_hits: int = 0
+        self.prerender_waits: int = 0
+        self.prerender_misses: int = 0
+        # the prerendered images not fetched yet, bounded as most challenges are fetched once or never
+        self._unfetched: OrderedDict[RenderKey, None] = OrderedDict()
+        # seconds from the creation of a challenge to its prerendered image being cached, of the latest prerenders
+        self._prerender_lags: deque[float] = deque(maxlen=TIMING_SAMPLES)
+
+    async def start(self) -> None:
+        """Start the workers."""
+        if self._executor is not None:
+            return
+        if self.executor_kind == "process":
+            # not forked from the web process, which already runs threads
+            start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context(start_method),
+            )
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="render")
+
+    async def stop(self) -> None:
+        """Stop the workers."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def render(self, challenge: "Challenge", width: int) -> bytes:
+        """Render the question of a challenge at the bucket of `width`, reusing the image cached for the same bucket.
+
+        Returns:
+            bytes: The PNG image.
+
+        Raises:
+            RenderQueueFullError: If the queue of waiting renders is full.
+
+        """
+        width = bucket_width(width)
+        key = (challenge.id, width)
+        image = self.cache.get(key)
+        if key in self._unfetched:
+            del self._unfetched[key]
+            if image is not None:
+                self.prerender_hits += 1
+            elif key in self._pending:
+                self.prerender_waits += 1
+            else:
+                self.prerender_misses += 1
+        if image is not None:
+            return image
+        if (pending := self._pending.get(key)) is None:
+            if len(self._pending) >= self.workers + self.queue_size:
+                self.rejected += 1
+                raise RenderQueueFullError
+            pending = self._submit(key, challenge)
+        # shielded, so a cancelled request does not cancel the render of the others waiting on it
+        return (await asyncio.shield(pending))[0]
+
+    def prerender(self, challenge: "Challenge", width: int = RENDER_PRERENDER_WIDTH) -> None:
+        """Render the question of a new challenge at the bucket of `width` in the background, into the cache.
+
+        The first fetch of the image is then a cache hit. The prerender is skipped unless a worker is free, so it
+        never delays the renders of the images being fetched, nor takes their place in the queue.
+        """
+        if not width or self._executor is None:
+            return
+        key = (challenge.id, bucket_width(width))
+        self.prerender_scheduled += 1
+        self._unfetched[key] = None
+        while len(self._unfetched) > PRERENDER_TRACKED:
+            self._unfetched.popitem(last=False)
+        if self.cache.budget <= 0 or key in self._pending or len(self._pending) >= self.workers:
+            self.prerender_skipped += 1
+            return
+        self._submit(key, challenge).add_done_callback(partial(self._finish_prerender, challenge.created_at))
+
+    def _submit(self, key: RenderKey, challenge: "Challenge") -> asyncio.Future[tuple[bytes, float, float]]:
+        pending = asyncio.get_running_loop().run_in_executor(self._executor, _render_job, challenge.question, key[1])
+        self._pending[key] = pending
+        pending.add_done_callback(partial(self._finish, key, challenge.created_at, time.monotonic()))
+        return pending
+
+    def _finish_prerender(self, created_at: datetime, future: asyncio.Future[tuple[bytes, float, float]]) -> None:
+        if future.cancelled() or future.exception() is not None:
+            return
+        self.prerendered += 1
+        self._prerender_lags.append((datetime.now(UTC) - created_at).total_seconds())
+
+    def _finish(
+        self,
+        key: RenderKey,
+        created_at: datetime,
+        submitted: float,
+        future: asyncio.Future[tuple[bytes, float, float]],
+    ) -> None:
+        self._pending.pop(key, None)
+        if future.cancelled() or future.exception() is not None:
+            return
+        image, started, seconds = future.result()
+        self._timings.append((max(0.0, started - submitted), seconds))
+        self.rendered += 1
+        age = (datetime.now(UTC) - created_at).total_seconds()
+        self.cache.put(key, image, CHALLENGE_LIFETIME - age)
+
+    def stats(self) -> RenderStats:
+        """Get the current statistic of the rendering in the server process.
+
+        Returns:
+            RenderStats: The statistic of the rendering.
+
+        """
+        waits = sorted(wait for wait, _ in self._timings)
+        renders = sorted(seconds for _, seconds in self._timings)
+        lags = sorted(self._prerender_lags)
+        fetched = self.prerender_hits + self.prerender_waits + self.prerender_misses
+        return RenderStats(
+            font=FONTS.stats(),
+            cache=self.cache.stats(),
+            queue=RenderQueueStats(
+                executor=self.executor_kind,
+                workers=self.workers,
+                queue_size=self.queue_size,
+                in_flight=len(self._pending),
+                rendered=self.rendered,
+                rejected=self.rejected,
+                wait_p50=percentile(waits, 0.5),
+                wait_p99=percentile(waits, 0.99),
+                render_p50=percentile(renders, 0.5),
+                render_p99=percentile(renders, 0.99),
+            ),
+            prerender=PrerenderStats(
+                width=bucket_width(RENDER_PRERENDER_WIDTH) if RENDER_PRERENDER_WIDTH else 0,
+                scheduled=self.prerender_scheduled,
+                skipped=self.prerender_skipped,
+                rendered=self.prerendered,
+                hits=self.prerender_hits,
+                waits=self.prerender_waits,
+                misses=self.prerender_misses,
+                hit_rate=self.prerender_hits / fetched if fetched else 0.0,
+                lag_p50=percentile(lags, 0.5),
+                lag_p99=percentile(lags, 0.99),
+            ),
+        )
@@ -0,0 +1,112 @@
+import math
+import weakref
+from collections.abc import Sequence
+from random import Random
+
+from server.captcha.schema.questions import Part, Question, QuestionSet
+
+# Amount of weighted draws over the budget before falling back to the cheapest entry
+MAX_REJECT = 8
+# Amount of question set versions whose samplers are kept, the oldest are dropped first
+SAMPLER_VERSIONS = 4
+
+
+class AliasTable:
+    """Vose's alias method, to draw an index with probability proportional to its weight in O(1)."""
+
+    __slots__ = ("alias", "probability")
+
+    def __init__(self, weights: Sequence[float]) -> None:
+        total = sum(weights)
+        if not weights or total <= 0 or any(weight < 0 for weight in weights):
+            raise ValueError("Weights should be non-negative with a positive sum")
+        size = len(weights)
+        scaled = [weight * size / total for weight in weights]
+        self.probability: list[float] = [1.0] * size
+        self.alias: list[int] = list(range(size))
+        small = [i for i, weight in enumerate(scaled) if weight < 1]
+        large = [i for i, weight in enumerate(scaled) if weight >= 1]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            self.probability[less] = scaled[less]
+            self.alias[less] = more
+            scaled[more] -= 1 - scaled[less]
+            (small if scaled[more] < 1 else large).append(more)
+        # the rest are 1 up to rounding error, and keep the default of never using the alias
+
+    def sample(self, random_obj: Random) -> int:
+        """Draw an index.
+
+        Returns:
+            int: The drawn index.
+
+        """
+        index = random_obj.randrange(len(self.alias))
+        return index if random_obj.random() < self.probability[index] else self.alias[index]
+
+
+class EntrySampler[T: Part]:
+    """Pick `base` or `part` entries by their `weight`, among the ones with a `cost` within the allowed cost.
+
+    When every weight is the default and nothing is over budget,
+    this is the same draw as `random_obj.choice`, so the generated questions stay the same for a given seed.
+    """
+
+    def __init__(self, entries: Sequence[T]) -> None:
+        self.entries: Sequence[T] = entries
+        self.costs: list[float] = [entry.cost or 0.0 for entry in entries]
+        self.uniform: bool = all(entry.weight == 1 for entry in entries)
+        self.table: AliasTable | None = AliasTable([entry.weight for entry in entries]) if entries else None
+        candidates = [i for i, entry in enumerate(entries) if entry.weight > 0]
+        self.cheapest: int | None = min(candidates, key=self.costs.__getitem__, default=None)
+        self.min_cost: float = 0.0 if self.cheapest is None else self.costs[self.cheapest]
+
+    def pick(self, random_obj: Random, allowed: float = math.inf) -> T:
+        """Draw an entry with a cost of at most `allowed`, or the cheapest entry if none is drawn.
+
+        Returns:
+            T: The picked entry.
+
+        Raises:
+            IndexError: If there is no entry.
+
+        """
+        if self.uniform and allowed == math.inf:
+            return random_obj.choice(self.entries)
+        if self.table is None or self.cheapest is None:
+            raise IndexError("Cannot choose from an empty sequence")
+        for _ in range(MAX_REJECT):
+            index = self.table.sample(random_obj)
+            if self.costs[index] <= allowed:
+                return self.entries[index]
+        return self.entries[self.cheapest]
+
+
+type Samplers = tuple[EntrySampler[Question], EntrySampler[Part]]
+
+_samplers: dict[int, Samplers] = {}
+_version_samplers: dict[int, Samplers] = {}
+
+
+def get_samplers(question_set: QuestionSet, version: int | None = None) -> Samplers:
+    """Get the samplers of the `base` and `part` entries, built once for each question set.
+
+    A question set sent to a worker process is a new copy on every call, so with the `version` of the question set
+    in its store the samplers are built once for each version instead.
+
+    Returns:
+        Samplers: The sampler of `base` and of `part`.
+
+    """
+    if version is not None:
+        if version not in _version_samplers:
+            if len(_version_samplers) >= SAMPLER_VERSIONS:
+                del _version_samplers[next(iter(_version_samplers))]
+            _version_samplers[version] = (EntrySampler(question_set.base), EntrySampler(question_set.part))
+        return _version_samplers[version]
+    key = id(question_set)
+    if key not in _samplers:
+        _samplers[key] = (EntrySampler(question_set.base), EntrySampler(question_set.part))
+        # dropped with the question set, so the id cannot be reused by another one
+        weakref.finalize(question_set, _samplers.pop, key, None)
+    return _samplers[key]
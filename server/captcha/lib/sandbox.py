@@ -0,0 +1,177 @@
+import contextlib
+import logging
+import multiprocessing
+import queue
+import threading
+from collections.abc import Callable
+from concurrent.futures import Executor, Future
+from multiprocessing.connection import Connection
+from multiprocessing.context import BaseContext
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    from multiprocessing.process import BaseProcess
+
+LOGGER = logging.getLogger("app")
+
+# Imported once by the forkserver, so every worker forked from it start with them loaded
+PRELOAD_MODULES = ["math", "numpy", "sympy", "server.captcha.lib.utils"]
+
+type Job = tuple[Future[Any], Callable[..., Any], tuple[Any, ...]]
+
+
+class SandboxError(Exception):
+    """A job did not finish in its sandbox worker, which was replaced by a new one."""
+
+
+def _limit_cpu(cpu_seconds: int) -> None:
+    import resource  # noqa: PLC0415 POSIX only, and only needed inside a worker
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    # only the soft limit is moved, as an unprivileged process cannot raise its hard limit again
+    soft = int(usage.ru_utime + usage.ru_stime) + 1 + cpu_seconds
+    resource.setrlimit(resource.RLIMIT_CPU, (soft if hard == resource.RLIM_INFINITY else min(soft, hard), hard))
+
+
+def _worker_main(conn: Connection, cpu_seconds: int, memory_bytes: int, table_directory: Path | None) -> None:
+    """Run the jobs received from `conn` until it is closed, each within `cpu_seconds` of CPU time."""
+    import resource  # noqa: PLC0415 POSIX only, and only needed inside a worker
+
+    from server.captcha.lib.number_theory import load_table  # noqa: PLC0415 imported after fork
+
+    if memory_bytes > 0:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_bytes, memory_bytes))
+    if table_directory is not None:
+        load_table(table_directory)
+    while True:
+        try:
+            fn, args = conn.recv()
+        except EOFError:
+            return
+        if cpu_seconds > 0:
+            _limit_cpu(cpu_seconds)
+        try:
+            result = (True, fn(*args))
+        except Exception as e:  # noqa: BLE001 the exception is raised from the future instead
+            result = (False, e)
+        try:
+            conn.send(result)
+        except Exception as e:  # noqa: BLE001 such as an unpicklable result
+            conn.send((False, SandboxError(f"Failed to send the result: {e!r}")))
+
+
+class _Worker:
+    """A sandbox process with the pipe sending its jobs."""
+
+    __slots__ = ("conn", "process")
+
+    def __init__(self, context: BaseContext, args: tuple[Any, ...]) -> None:
+        self.conn: Connection
+        child_conn: Connection
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process: BaseProcess = context.Process(
+            target=_worker_main,
+            args=(child_conn, *args),
+            name="question-sandbox",
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+
+    def kill(self) -> None:
+        self.conn.close()
+        self.process.kill()
+        self.process.join()
+
+
+class SandboxExecutor(Executor):
+    """Run jobs in worker processes forked from a forkserver, under CPU time, memory and wall-clock limits.
+
+    The forkserver imports `PRELOAD_MODULES` once, so a new worker does not import sympy again.
+    A worker exceeding `timeout` seconds is killed, one exceeding `cpu_seconds` or `memory_bytes` is killed or get
+    `MemoryError` from the kernel, and the job raises `SandboxError` while a new worker replace it.
+    The limits are applied with `resource`, which is only available on POSIX.
+    """
+
+    def __init__(
+        self,
+        max_workers: int,
+        timeout: float,
+        cpu_seconds: int = 0,
+        memory_bytes: int = 0,
+        table_directory: Path | None = None,
+    ) -> None:
+        self.timeout: float = timeout
+        self._context: BaseContext = multiprocessing.get_context("forkserver")
+        self._context.set_forkserver_preload(PRELOAD_MODULES)
+        self._worker_args: tuple[Any, ...] = (cpu_seconds, memory_bytes, table_directory)
+        self._jobs: queue.SimpleQueue[Job | None] = queue.SimpleQueue()
+        self._shutdown: bool = False
+        self._threads: list[threading.Thread] = [
+            threading.Thread(target=self._dispatch, name=f"question-sandbox-{i}", daemon=True)
+            for i in range(max_workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, fn: Callable[..., Any], /, *args: Any, **kwargs: Any) -> Future[Any]:  # noqa: ANN401, D102
+        if self._shutdown:
+            raise RuntimeError("cannot schedule new futures after shutdown")
+        if kwargs:
+            raise TypeError("SandboxExecutor does not support keyword arguments")
+        future: Future[Any] = Future()
+        self._jobs.put((future, fn, args))
+        return future
+
+    def shutdown(self, wait: bool = True, *, cancel_futures: bool = False) -> None:  # noqa: D102, FBT001, FBT002
+        self._shutdown = True
+        if cancel_futures:
+            with contextlib.suppress(queue.Empty):
+                while (job := self._jobs.get_nowait()) is not None:
+                    job[0].cancel()
+        for _ in self._threads:
+            self._jobs.put(None)
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    def _run(self, worker: _Worker, fn: Callable[..., Any], args: tuple[Any, ...]) -> Any:  # noqa: ANN401
+        try:
+            worker.conn.send((fn, args))
+        except OSError as e:
+            raise SandboxError(f"Worker exited with code {worker.process.exitcode}") from e
+        if not worker.conn.poll(self.timeout):
+            raise SandboxError(f"Job exceeded the timeout of {self.timeout}s")
+        try:
+            success, value = worker.conn.recv()
+        except (EOFError, OSError) as e:
+            # EOF once the worker exited, or a reset connection if it died with the job still unread
+            worker.process.join(1)
+            raise SandboxError(f"Worker exited with code {worker.process.exitcode}") from e
+        if not success:
+            raise value
+        return value
+
+    def _dispatch(self) -> None:
+        worker: _Worker | None = None
+        try:
+            while (job := self._jobs.get()) is not None:
+                future, fn, args = job
+                if not future.set_running_or_notify_cancel():
+                    continue
+                if worker is None:
+                    worker = _Worker(self._context, self._worker_args)
+                try:
+                    future.set_result(self._run(worker, fn, args))
+                except SandboxError as e:
+                    LOGGER.warning("Recycling question sandbox worker: %s", e)
+                    worker.kill()
+                    worker = None
+                    future.set_exception(e)
+                except Exception as e:  # noqa: BLE001 raised by the job itself, the worker is still usable
+                    future.set_exception(e)
+        finally:
+            if worker is not None:
+                worker.kill()
@@ -0,0 +1,140 @@
+from collections.abc import Mapping
+from functools import cache, lru_cache
+from random import Random
+
+from server.captcha.lib.validator import GROUP_VALUE_COMPILED
+from server.captcha.schema.questions import Part, Question, QuestionSection, QuestionSet
+
+DEFAULT_VALUE_RANGE = (1, 65536)
+# The construct of a requested amount of parts, `{init} {dyn:base}` followed by `parts` times `CHAIN_STEP`
+CHAIN_HEAD = "{init} {dyn:base}"
+CHAIN_STEP = " {cont} {dyn:part}"
+# Chain templates kept tokenized, each holding a tuple per placeholder, so they are not all kept like constructs
+CHAIN_CACHE_SIZE = 64
+
+
+class Template:
+    """A `construct`, `question` or `validator` string split at its placeholders once, instead of on every fill.
+
+    `literals[i]` is the text before `placeholders[i]`, a pair of the key (without `dyn:`) and the original text.
+    """
+
+    __slots__ = ("format", "keys", "literals", "placeholders", "tail")
+
+    def __init__(self, template: str) -> None:
+        literals: list[str] = []
+        placeholders: list[tuple[str, str]] = []
+        position = 0
+        for match in GROUP_VALUE_COMPILED.finditer(template):
+            literals.append(template[position : match.start()])
+            placeholders.append((match.group(2), match.group(0)))
+            position = match.end()
+        self.literals: tuple[str, ...] = tuple(literals)
+        self.placeholders: tuple[tuple[str, str], ...] = tuple(placeholders)
+        self.tail: str = template[position:]
+        self.keys: tuple[str, ...] = tuple(dict.fromkeys(key for key, _ in placeholders))
+        # the same text as a `str.format` template, so filling it is a single call in C
+        escape = str.maketrans({"{": "{{", "}": "}}"})
+        self.format: str = "".join(
+            f"{literal.translate(escape)}{{{key}}}" for literal, (key, _) in zip(literals, placeholders, strict=True)
+        ) + self.tail.translate(escape)
+
+    def fill(self, values: Mapping[str, int]) -> str:
+        """Replace every placeholder by its value.
+
+        Returns:
+            str: The filled text.
+
+        """
+        return self.format.format_map(values)
+
+
+@cache
+def compile_template(template: str) -> Template:
+    """Get the tokenized template, tokenizing it on first use.
+
+    Returns:
+        Template: The tokenized template.
+
+    """
+    return Template(template)
+
+
+def chain_label(parts: int) -> str:
+    """Get the name of the construct of `parts` parts, as recorded in the generator statistics.
+
+    Returns:
+        str: The construct in the form of `{init} {dyn:base}( {cont} {dyn:part})*parts`.
+
+    """
+    return f"{CHAIN_HEAD}({CHAIN_STEP})*{parts}"
+
+
+@lru_cache(maxsize=CHAIN_CACHE_SIZE)
+def compile_chain(parts: int) -> Template:
+    """Get the tokenized construct of a `base` followed by `parts` parts, synthesized instead of declared.
+
+    Returns:
+        Template: The tokenized construct.
+
+    """
+    return Template(CHAIN_HEAD + CHAIN_STEP * parts)
+
+
+class SectionTemplate:
+    """The tokenized `question` and `validator` of a `base` or `part`, with the keys in the order they are drawn."""
+
+    __slots__ = ("keys", "question", "validator")
+
+    def __init__(self, question: str, validator: str) -> None:
+        self.question: Template = compile_template(question)
+        self.validator: Template = compile_template(validator)
+        self.keys: tuple[str, ...] = tuple(dict.fromkeys((*self.question.keys, *self.validator.keys)))
+
+    def fill(self, entry: Question | Part, random_obj: Random) -> QuestionSection:
+        """Draw the values of every placeholder, in the order they first appear, and fill both templates.
+
+        Returns:
+            QuestionSection: The filled question section with generated values.
+
+        """
+        ranges = entry.range
+        values = {key: random_obj.randint(*ranges.get(key, DEFAULT_VALUE_RANGE)) for key in self.keys}
+        return QuestionSection(
+            question=self.question.fill(values),
+            validator=self.validator.fill(values),
+            values=values,
+        )
+
+
+@cache
+def compile_section(question: str, validator: str) -> SectionTemplate:
+    """Get the tokenized templates of a `base` or `part`, tokenizing them on first use.
+
+    Returns:
+        SectionTemplate: The tokenized templates.
+
+    """
+    return SectionTemplate(question, validator)
+
+
+def average_parts(question_set: QuestionSet) -> float:
+    """Get the average amount of `part` of the `construct` of the question set, as picked when no parts are requested.
+
+    Returns:
+        float: The average amount of `{dyn:part}` placeholders of a construct.
+
+    """
+    counts = [
+        sum(key == "part" for key, _ in compile_template(construct).placeholders)
+        for construct in question_set.construct
+    ]
+    return sum(counts) / len(counts) if counts else 0
+
+
+def compile_templates(question_set: QuestionSet) -> None:
+    """Tokenize every `construct`, and the `question` and `validator` of every `base` and `part` ahead of time."""
+    for construct in question_set.construct:
+        compile_template(construct)
+    for entry in (*question_set.base, *question_set.part):
+        compile_section(entry.question, entry.validator)
@@ -1,12 +1,9 @@
 import logging
 import math
-import re
 import time
-from collections.abc import Callable
 from random import Random
 from typing import TYPE_CHECKING, Literal
 
-import sympy
 from advanced_alchemy.exceptions import IntegrityError, NotFoundError, RepositoryError
 from advanced_alchemy.extensions.litestar.exception_handler import (
     ConflictError,
@@ -18,11 +15,23 @@ from litestar.exceptions import (
 )
 from litestar.exceptions.responses import create_exception_response
 from litestar.status_codes import HTTP_409_CONFLICT, HTTP_500_INTERNAL_SERVER_ERROR
+from server.captcha.lib.config import FUSE_MIN_TASKS, QUESTION_BIT_BUDGET, QUESTION_COST_BUDGET, QUESTION_MIN_DISTINCT
+from server.captcha.lib.fuse import GrowthGuardError, fuse_chain
+from server.captcha.lib.lazy import lazy_import
+from server.captcha.lib.sampling import get_samplers
+from server.captcha.lib.template import chain_label, compile_chain, compile_section, compile_template
+from server.captcha.lib.vectorize import Answers, apply_validator, to_list
 from server.captcha.schema.questions import GeneratedQuestion, Part, Question, QuestionSection, QuestionSet
 
-GROUP_VALUE_REGEX = r"{(dyn:)?([a-zA-Z_\-]+)}"
-GROUP_VALUE_COMPILED = re.compile(GROUP_VALUE_REGEX)
+if TYPE_CHECKING:
+    import numpy as np
+else:
+    np = lazy_import("numpy")
+
 LOGGER = logging.getLogger("app")
+MAX_PART_REDRAW = 16
+MAX_COLLAPSE_REDRAW = 8
+TASK_AMOUNT = (5, 12)
 
 
 class _HTTPConflictException(HTTPException):
@@ -47,23 +56,13 @@ def exception_handler(  # noqa: D103
             HTTPException(
                 status_code=getattr(exc, "status_code", HTTP_500_INTERNAL_SERVER_ERROR),
                 detail=str(exc),
+                headers=getattr(exc, "headers", None),
             ),
         )
 
     return create_exception_response(request, http_exc(detail=str(exc.detail)))
 
 
-class DefaulyDictByKey[K, V](dict[K, V]):
-    """defaultdict but the factory function take the key as parameter would generate new value each time."""
-
-    def __init__(self, factory: Callable[[K], V]) -> None:
-        self._factory: Callable[[K], V] = factory
-
-    def __missing__(self, key: K) -> V:
-        self[key] = self._factory(key)
-        return self[key]
-
-
 def fill_question(question: Question | Part, random_obj: Random) -> QuestionSection:
     """Fill the question detail with random value.
 
@@ -71,32 +70,57 @@ def fill_question(question: Question | Part, random_obj: Random) -> QuestionSect
         QuestionSection: The filled question section with generated values.
 
     """
+    return compile_section(question.question, question.validator).fill(question, random_obj)
 
-    def gen_value(val_name: str) -> int:
-        if val_name in question.range:
-            return random_obj.randint(*question.range[val_name])
-        return random_obj.randint(1, 65536)
 
-    values = DefaulyDictByKey(gen_value)
+def _max_bit_length(values: Answers) -> int:
+    if isinstance(values, list):
+        return max((int(value).bit_length() for value in values), default=0)
+    return int(abs(values).max()).bit_length() if values.size else 0
 
-    def sub_function(match: re.Match) -> str:
-        key: str = match.group(2)  # ignore `dyn:`
-        return f"{values[key]}"
 
-    gen_question = GROUP_VALUE_COMPILED.sub(sub_function, question.question)
-    gen_validator = GROUP_VALUE_COMPILED.sub(sub_function, question.validator)
-    return QuestionSection(
-        question=gen_question,
-        validator=gen_validator,
-    )
+def _distinct(values: Answers) -> int:
+    if isinstance(values, list):
+        return len(set(values))
+    return int(np.unique(values).size)
 
 
-def question_generator(question_set: QuestionSet, seed: int | None = None) -> GeneratedQuestion:  # noqa: C901, PLR0915
+def _merge(values: Answers) -> tuple[Answers, list[int]]:
+    """Merge the equal values.
+
+    Returns:
+        tuple[Answers, list[int]]: The distinct values, and the index of each value in them.
+
+    """
+    if isinstance(values, list):
+        lookup: dict[int, int] = {}
+        index = [lookup.setdefault(value, len(lookup)) for value in values]
+        return list(lookup), index
+    distinct, inverse = np.unique(values, return_inverse=True)
+    return distinct, inverse.tolist()
+
+
+def question_generator(  # noqa: C901, PLR0913, PLR0915
+    question_set: QuestionSet,
+    seed: int | None = None,
+    bit_budget: int = QUESTION_BIT_BUDGET,
+    cost_budget: float = QUESTION_COST_BUDGET,
+    min_distinct: int = QUESTION_MIN_DISTINCT,
+    parts: int | None = None,
+    version: int | None = None,
+) -> GeneratedQuestion:
     """Generate a random question from QuestionSet.
 
     Args:
         question_set: The set of questions to generate from.
         seed: Optional seed for deterministic random generation.
+        bit_budget: The maximum bit length of any intermediate answer, a `part` exceeding it is redrawn.
+        cost_budget: The maximum predicted microseconds to calculate the answers, from the `cost` of the picked
+            entries with the largest amount of tasks. Entries without `cost` are free, 0 to disable.
+        min_distinct: The minimum amount of distinct answers after each `part`, a `part` collapsing the answers below
+            it is redrawn, 0 to disable.
+        parts: The amount of `part` after the `base`, in a construct synthesized instead of picked from `construct`.
+        version: The version of the question set in its store, to reuse its samplers in a worker process.
 
     Returns:
         GeneratedQuestion: The generated question with tasks and solutions.
@@ -106,82 +130,150 @@ def question_generator(question_set: QuestionSet, seed: int | None = None) -> Ge
 
     """
     random_obj = Random(seed)  # noqa: S311 it was decided to be determistic
-    construct = random_obj.choice(question_set.construct)
-    validator_part: list[str] = []
+    if parts is None:
+        construct = random_obj.choice(question_set.construct)
+        template = compile_template(construct)
+    else:
+        construct = chain_label(parts)
+        template = compile_chain(parts)
+    pieces: list[str] = []
+    validator_part: list[tuple[int, Question | Part, QuestionSection]] = []
     value_range: tuple[int, int] | None = None
-
-    def sub_function(match: re.Match) -> str:
-        nonlocal value_range
-        key: Literal["construct", "base", "part", "init", "cont"] = match.group(2)
+    base_sampler, part_sampler = get_samplers(question_set, version)
+    # predicted microseconds of one task through the whole chain
+    task_budget = cost_budget / TASK_AMOUNT[1] if cost_budget > 0 else math.inf
+    # the picks left after the current one, whose cheapest cost is reserved from the budget
+    pending_base = sum(key == "base" for key, _ in template.placeholders)
+    pending_part = sum(key == "part" for key, _ in template.placeholders)
+    spent = 0.0
+
+    def allowed_cost() -> float:
+        if task_budget == math.inf:
+            return math.inf
+        reserved = pending_base * base_sampler.min_cost + pending_part * part_sampler.min_cost
+        return task_budget - spent - reserved
+
+    def sub_function(key: Literal["construct", "base", "part", "init", "cont"], placeholder: str) -> str:
+        nonlocal value_range, pending_base, pending_part, spent
         match key:
             case "construct":
                 raise ValueError("`construct` should not exist inside `construct`")
             case "base":
                 if value_range is not None:
                     raise ValueError("`base` should not exist more than once")
-                options = question_set.base
-                picked = random_obj.choice(options)
+                pending_base -= 1
+                picked = base_sampler.pick(random_obj, allowed_cost())
+                spent += picked.cost or 0.0
                 section: QuestionSection = fill_question(picked, random_obj)
                 value_range = picked.input
-                validator_part.insert(0, section.validator)
+                validator_part.insert(0, (len(pieces), picked, section))
                 return section.question
             case "part":
-                options = question_set.part
-                picked = random_obj.choice(options)
+                pending_part -= 1
+                picked = part_sampler.pick(random_obj, allowed_cost())
+                spent += picked.cost or 0.0
                 section: QuestionSection = fill_question(picked, random_obj)
-                validator_part.append(section.validator)
+                validator_part.append((len(pieces), picked, section))
                 return section.question
             case "init":
                 return random_obj.choice(question_set.init)
             case "cont":
                 return random_obj.choice(question_set.cont)
             case _:
-                return match.group(0)
+                return placeholder
 
-    question = GROUP_VALUE_COMPILED.sub(sub_function, construct)
+    for literal, (key, placeholder) in zip(template.literals, template.placeholders, strict=True):
+        pieces.append(literal)
+        pieces.append(sub_function(key, placeholder))
+    pieces.append(template.tail)
 
     if TYPE_CHECKING:
         value_range = (0, 0)
     if value_range is None:
         raise ValueError("`base` should exist only once")
 
-    task_amount = random_obj.randint(5, 12)
+    task_amount = random_obj.randint(*TASK_AMOUNT)
     tasks = list({random_obj.randint(*value_range) for _ in range(task_amount)})
-    answers = tasks.copy()
+    answers: list[int] = tasks.copy()
+    rejected_parts: list[str] = []
+    collapses = 0
+    # limited for each step, so a long chain of parts gets as many replacements per step as a short one
+    step_collapses = [0] * len(validator_part)
+    # a step can only merge answers, so a collapse is detected and repaired at the step causing it
+    distinct_floor = min(min_distinct, len(tasks))
+
+    def replace_part(step: int) -> None:
+        nonlocal spent
+        index, picked, _ = validator_part[step]
+        # the tasks are drawn from the `input` of the `base`, so only its values are drawn again
+        if step > 0:
+            spent -= picked.cost or 0.0
+            picked = part_sampler.pick(random_obj, allowed_cost())
+            spent += picked.cost or 0.0
+        section = fill_question(picked, random_obj)
+        pieces[index] = section.question
+        validator_part[step] = (index, picked, section)
+
+    def redraw(step: int) -> None:
+        rejected_parts.append(validator_part[step][1].validator)
+        if len(rejected_parts) > MAX_PART_REDRAW:
+            raise OverflowError(f"Answers exceeded {bit_budget} bits after {MAX_PART_REDRAW} redraws")
+        replace_part(step)
+
+    def run_step(step: int, answers: Answers) -> Answers:
+        nonlocal collapses
+        while True:
+            _, picked, section = validator_part[step]
+            result = apply_validator(picked, section.values, answers)
+            # `base` have bounded output, only `part` chained on top of each other can grow without limit
+            if step > 0 and _max_bit_length(result) > bit_budget:
+                redraw(step)
+            elif step_collapses[step] < MAX_COLLAPSE_REDRAW and _distinct(result) < distinct_floor:
+                # the answers of the previous steps are kept, only this step is replaced
+                collapses += 1
+                step_collapses[step] += 1
+                replace_part(step)
+            else:
+                return result
+
+    def run_stepwise() -> list[int]:
+        # each step is only applied to the distinct answers, as tasks merged by a step stay merged
+        values: Answers = tasks.copy()
+        positions = list(range(len(tasks)))
+        for step in range(len(validator_part)):
+            values = run_step(step, values)
+            if _distinct(values) < len(values):
+                values, index = _merge(values)
+                positions = [index[position] for position in positions]
+        values = to_list(values)
+        return [values[position] for position in positions]
+
+    def run_fused() -> list[int]:
+        while True:
+            chain = fuse_chain([(picked, section.values) for _, picked, section in validator_part], bit_budget)
+            try:
+                return list(map(chain, tasks))
+            except GrowthGuardError as e:
+                redraw(e.step)
 
     start = time.perf_counter()
-    safe_globals = {
-        "__builtins__": __builtins__,
-        "abs": abs,
-        "min": min,
-        "max": max,
-        "bin": bin,
-        "int": int,
-        "len": len,
-        "sum": sum,
-        "pow": pow,
-        "math": math,
-        "sympy": sympy,
-        "factorial": math.factorial,
-        "prime": sympy.prime,
-        "fibonacci": sympy.fibonacci,
-        "divisors": sympy.divisors,
-        "prevprime": sympy.prevprime,
-    }
-    locals_dict = {}
     try:
-        for fn_str in validator_part:
-            exec(fn_str, safe_globals, locals_dict)  # noqa: S102 it run limited subset of questions in question_part.json
-            validateor_fn: Callable[[int], int] = locals_dict["validator"]
-            answers = list(map(validateor_fn, answers))
+        if 0 < FUSE_MIN_TASKS <= len(tasks):
+            answers = run_fused()
+            # the fused chain cannot tell which step collapsed, which is found again step by step
+            if _distinct(answers) < distinct_floor:
+                answers = run_stepwise()
+        else:
+            answers = run_stepwise()
+        question = "".join(pieces)
         str(answers)
     except Exception as e:
         issue_id = "".join(random_obj.choices("0123456789abcdef", k=32))
         message = f"""Failed to generate question
-Questions: {question}
+Questions: {"".join(pieces)}
 Tasks: {tasks}
 Validators:
-{"\n".join(f"  {fn!r}" for fn in validator_part)}
+{"\n".join(f"  {section.validator!r}" for _, _, section in validator_part)}
 Seed: {seed or "N/A"}
 Issue ID: {issue_id}
 Delta: {time.perf_counter() - start}s
@@ -201,4 +293,8 @@ Delta: {time.perf_counter() - start}s
         question=question,
         tasks=tasks,
         solutions=answers,
+        rejected_parts=rejected_parts,
+        construct=construct,
+        collapses=collapses,
+        collapsed=_distinct(answers) < distinct_floor,
     )
@@ -0,0 +1,172 @@
+import builtins
+import io
+import math
+import re
+import textwrap
+import tokenize
+from collections.abc import Callable, Iterable, Mapping
+from functools import cache
+from typing import Any
+
+from server.captcha.lib import number_theory
+from server.captcha.lib.number_theory import TABLE_SYMPY, table_import
+from server.captcha.schema.questions import Part, QuestionSet
+
+GROUP_VALUE_REGEX = r"{(dyn:)?([a-zA-Z_\-]+)}"
+GROUP_VALUE_COMPILED = re.compile(GROUP_VALUE_REGEX)
+
+SAFE_GLOBALS: dict[str, Any] = {
+    "__builtins__": {**vars(builtins), "__import__": table_import},
+    "abs": abs,
+    "min": min,
+    "max": max,
+    "bin": bin,
+    "int": int,
+    "len": len,
+    "sum": sum,
+    "pow": pow,
+    "math": math,
+    "sympy": TABLE_SYMPY,
+    "factorial": math.factorial,
+    "prime": number_theory.prime,
+    "fibonacci": number_theory.fibonacci,
+    "divisors": number_theory.divisors,
+    "divisor_count": number_theory.divisor_count,
+    "prevprime": number_theory.prevprime,
+}
+
+
+def slot_name(index: int) -> str:
+    """Get the python name of the `index`-th placeholder in a parametrized template.
+
+    Returns:
+        str: The name of the placeholder.
+
+    """
+    return f"_slot{index}"
+
+
+def _fits_name(template: str, match: re.Match[str]) -> bool:
+    before = template[match.start() - 1 : match.start()]
+    after = template[match.end() : match.end() + 2]
+    # glued to a name or a number, such as `1{y}` or `{y}.5`, the filled text is a different token than the value
+    return not (before.isalnum() or before in {"_", "."} or after[:1].isalnum() or after[:1] == "_") and not (
+        after[:1] == "." and after[1:].isdigit()
+    )
+
+
+def parametrize(template: str) -> tuple[tuple[str, ...], str] | None:
+    """Replace the placeholders in a validator template with python names.
+
+    Each placeholder has to stand where a name can go, so the name means the same as the filled value,
+    and not be in a string literal, such as `'{y}'`, or glued to a name or number, such as `1{y}`.
+
+    Returns:
+        tuple[tuple[str, ...], str] | None: The placeholder keys in the order of the names, and the parametrized
+            source, `None` if a placeholder does not stand where a name can go.
+
+    """
+    matches = list(GROUP_VALUE_COMPILED.finditer(template))
+    if not all(_fits_name(template, match) for match in matches):
+        return None
+    slots = tuple(dict.fromkeys(match.group(2) for match in matches))
+    names = {key: slot_name(i) for i, key in enumerate(slots)}
+    source = GROUP_VALUE_COMPILED.sub(lambda match: names[match.group(2)], template)
+    try:
+        tokens = list(tokenize.generate_tokens(io.StringIO(source).readline))
+    except (tokenize.TokenError, SyntaxError):
+        return None
+    slot_names = set(names.values())
+    if sum(token.type == tokenize.NAME and token.string in slot_names for token in tokens) != len(matches):
+        return None
+    # the body is indented into the factory function, which would change the text of a multi-line string
+    if any(token.type == tokenize.STRING and token.start[0] != token.end[0] for token in tokens):
+        return None
+    return slots, source
+
+
+def fill_validator(template: str, values: Mapping[str, int]) -> str:
+    """Replace the placeholders in a validator template with their values, as the question is filled.
+
+    Returns:
+        str: The source of the validator.
+
+    """
+    return GROUP_VALUE_COMPILED.sub(lambda match: str(values[match.group(2)]), template)
+
+
+class ValidatorFactory:
+    """A validator template compiled once, which only need to bind the random values for each question.
+
+    The placeholders (`{y}`, `{dyn:z}`, ...) in the template become the parameters of a generated factory function,
+    so `bind` is a plain function call instead of parsing and compiling the filled source again.
+    A template whose placeholders cannot be parameters, such as one in a string literal, is filled and compiled
+    on every `bind` instead.
+    """
+
+    __slots__ = ("_factory", "slots", "template")
+
+    def __init__(self, template: str) -> None:
+        self.template: str = template
+        self._factory: Callable[..., Callable[[int], int]] | None = None
+        parametrized = parametrize(template)
+        if parametrized is None:
+            self.slots: tuple[str, ...] = tuple(
+                dict.fromkeys(match.group(2) for match in GROUP_VALUE_COMPILED.finditer(template)),
+            )
+            # compiled once with sample values, so an invalid template is still rejected at load
+            compile(fill_validator(template, dict.fromkeys(self.slots, 1)), f"<validator {template!r}>", "exec")
+            return
+        self.slots, body = parametrized
+        params = ", ".join(slot_name(i) for i in range(len(self.slots)))
+        source = f"def _validator_factory({params}):\n{textwrap.indent(body, '    ')}\n    return validator\n"
+        namespace: dict[str, Any] = {}
+        exec(compile(source, f"<validator {template!r}>", "exec"), SAFE_GLOBALS, namespace)  # noqa: S102 it run limited subset of questions in question_part.json
+        self._factory = namespace["_validator_factory"]
+
+    def _exec(self, values: Mapping[str, int]) -> Callable[[int], int]:
+        # one namespace, so the names the template imports or defines are visible in the validator
+        namespace: dict[str, Any] = dict(SAFE_GLOBALS)
+        source = fill_validator(self.template, values)
+        exec(compile(source, f"<validator {self.template!r}>", "exec"), namespace)  # noqa: S102 it run limited subset of questions in question_part.json
+        return namespace["validator"]
+
+    def bind(self, values: Mapping[str, int]) -> Callable[[int], int]:
+        """Create the validator function with the placeholders replaced by `values`.
+
+        Returns:
+            Callable[[int], int]: The validator for a single step of the question.
+
+        """
+        if self._factory is None:
+            return self._exec(values)
+        return self._factory(*(values[key] for key in self.slots))
+
+
+@cache
+def compile_validator(template: str) -> ValidatorFactory:
+    """Get the compiled factory of a validator template, compiling it on first use.
+
+    Returns:
+        ValidatorFactory: The factory of the validator template.
+
+    """
+    return ValidatorFactory(template)
+
+
+def compile_question_set(question_set: QuestionSet) -> None:
+    """Compile every `base` and `part` validator in the question set ahead of time.
+
+    Raises:
+        ValueError: If any of the validator is not valid python, or every `base` or every `part` has a weight of 0.
+
+    """
+    for name, section in (("base", question_set.base), ("part", question_set.part)):
+        if section and not any(entry.weight > 0 for entry in section):
+            raise ValueError(f"Every `{name}` has a weight of 0, at least one must be positive")
+    entries: Iterable[Part] = (*question_set.base, *question_set.part)
+    for entry in entries:
+        try:
+            compile_validator(entry.validator)
+        except SyntaxError as e:
+            raise ValueError(f"Invalid validator {entry.validator!r}: {e}") from e
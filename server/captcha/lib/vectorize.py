@@ -0,0 +1,318 @@
+import ast
+import operator
+from collections.abc import Callable, Mapping
+from functools import cache
+from typing import TYPE_CHECKING
+
+from server.captcha.lib.config import VECTORIZE_MIN_TASKS
+from server.captcha.lib.lazy import lazy_import
+from server.captcha.lib.memo import STEP_MEMO
+from server.captcha.lib.validator import compile_validator, parametrize, slot_name
+from server.captcha.schema.questions import Part
+
+if TYPE_CHECKING:
+    import numpy as np
+else:
+    # only imported by the first vector evaluation, short lists of answers never need it
+    np = lazy_import("numpy")
+
+# Every value in a vector stay below this magnitude, so no int64 operation below can overflow unnoticed
+LIMIT = 1 << 62
+
+type Vector = np.ndarray
+type Value = Vector | int
+type Answers = list[int] | Vector
+type Node = Callable[[Vector, tuple[int, ...]], Value]
+
+
+class VectorFallbackError(Exception):
+    """The vector cannot be evaluated with int64 exactly, it should be evaluated with python int instead."""
+
+
+def _magnitude(value: Value) -> int:
+    if isinstance(value, int):
+        return abs(value)
+    return int(np.abs(value).max()) if value.size else 0
+
+
+def _check(bound: int) -> None:
+    if bound >= LIMIT:
+        raise VectorFallbackError
+
+
+def _add(a: Value, b: Value) -> Value:
+    _check(_magnitude(a) + _magnitude(b))
+    return a + b
+
+
+def _sub(a: Value, b: Value) -> Value:
+    _check(_magnitude(a) + _magnitude(b))
+    return a - b
+
+
+def _mul(a: Value, b: Value) -> Value:
+    _check(_magnitude(a) * _magnitude(b))
+    return a * b
+
+
+def _nonzero_divisor(b: Value) -> None:
+    # python raises `ZeroDivisionError` while numpy silently return 0
+    if (b == 0) if isinstance(b, int) else not b.all():
+        raise VectorFallbackError
+
+
+def _floordiv(a: Value, b: Value) -> Value:
+    _nonzero_divisor(b)
+    return a // b
+
+
+def _mod(a: Value, b: Value) -> Value:
+    _nonzero_divisor(b)
+    return a % b
+
+
+def _pow(a: Value, b: Value) -> Value:
+    if not isinstance(b, int) or b < 0:
+        raise VectorFallbackError
+    base = _magnitude(a)
+    if base > 1 and b >= LIMIT.bit_length():
+        raise VectorFallbackError
+    _check(base**b)
+    return a**b
+
+
+def _shift_amount(b: Value) -> int:
+    # python raises `ValueError` on negative shift, and numpy shift of 64 bits or more is undefined
+    if (b < 0) if isinstance(b, int) else (b < 0).any():
+        raise VectorFallbackError
+    shift = _magnitude(b)
+    if shift >= LIMIT.bit_length():
+        raise VectorFallbackError
+    return shift
+
+
+def _lshift(a: Value, b: Value) -> Value:
+    _check(_magnitude(a) << _shift_amount(b))
+    return a << b
+
+
+def _rshift(a: Value, b: Value) -> Value:
+    _shift_amount(b)
+    return a >> b
+
+
+def _invert(a: Value) -> Value:
+    # ~x is -x-1, so the magnitude can grow by one
+    _check(_magnitude(a) + 1)
+    return ~a
+
+
+# The python operation used when every operand is a scalar, and the checked vector operation
+BINARY_OPERATORS: dict[type[ast.operator], tuple[Callable[[int, int], int], Callable[[Value, Value], Value]]] = {
+    ast.Add: (operator.add, _add),
+    ast.Sub: (operator.sub, _sub),
+    ast.Mult: (operator.mul, _mul),
+    ast.FloorDiv: (operator.floordiv, _floordiv),
+    ast.Mod: (operator.mod, _mod),
+    ast.Pow: (operator.pow, _pow),
+    ast.LShift: (operator.lshift, _lshift),
+    ast.RShift: (operator.rshift, _rshift),
+    ast.BitAnd: (operator.and_, operator.and_),
+    ast.BitOr: (operator.or_, operator.or_),
+    ast.BitXor: (operator.xor, operator.xor),
+}
+UNARY_OPERATORS: dict[type[ast.unaryop], Callable[[Value], Value]] = {
+    ast.UAdd: operator.pos,
+    ast.USub: operator.neg,
+    ast.Invert: _invert,
+}
+
+
+def _absolute(value: Value) -> Value:
+    return np.abs(value)
+
+
+def _minimum(*args: Value) -> Value:
+    return np.minimum(*args)
+
+
+def _maximum(*args: Value) -> Value:
+    return np.maximum(*args)
+
+
+FUNCTIONS: dict[str, tuple[Callable[..., int], Callable[..., Value]]] = {
+    "abs": (abs, _absolute),
+    "min": (min, _minimum),
+    "max": (max, _maximum),
+}
+
+
+def _dispatch(scalar_fn: Callable[..., int], vector_fn: Callable[..., Value], *args: Value) -> Value:
+    if all(isinstance(arg, int) for arg in args):
+        result = scalar_fn(*args)
+        if not isinstance(result, int):  # such as negative power
+            raise VectorFallbackError
+        return result
+    return vector_fn(*args)
+
+
+def _build(node: ast.expr, arg: str, slots: dict[str, int]) -> Node | None:  # noqa: C901, PLR0911
+    """Build the vector evaluation of an expression, or `None` if it is not pure int arithmetic.
+
+    Returns:
+        Node | None: The evaluation of the expression on a vector.
+
+    """
+    match node:
+        case ast.Constant(value=int() as value) if not isinstance(value, bool):
+            return lambda _x, _values: value
+        case ast.Name(id=name) if name == arg:
+            return lambda x, _values: x
+        case ast.Name(id=name) if name in slots:
+            index = slots[name]
+            return lambda _x, values: values[index]
+        case ast.BinOp(left=left, op=op, right=right) if type(op) in BINARY_OPERATORS:
+            scalar_fn, vector_fn = BINARY_OPERATORS[type(op)]
+            left_node, right_node = _build(left, arg, slots), _build(right, arg, slots)
+            if left_node is None or right_node is None:
+                return None
+            return lambda x, values: _dispatch(scalar_fn, vector_fn, left_node(x, values), right_node(x, values))
+        case ast.UnaryOp(op=op, operand=operand) if type(op) in UNARY_OPERATORS:
+            fn = UNARY_OPERATORS[type(op)]
+            operand_node = _build(operand, arg, slots)
+            if operand_node is None:
+                return None
+            return lambda x, values: fn(operand_node(x, values))
+        case ast.Call(func=ast.Name(id=name), args=args, keywords=[]) if name in FUNCTIONS:
+            if (name == "abs") != (len(args) == 1) or len(args) > 2:  # noqa: PLR2004
+                return None
+            scalar_fn, vector_fn = FUNCTIONS[name]
+            arg_nodes = [_build(item, arg, slots) for item in args]
+            if any(item is None for item in arg_nodes):
+                return None
+            return lambda x, values: _dispatch(
+                scalar_fn,
+                vector_fn,
+                *(item(x, values) for item in arg_nodes),  # type: ignore[reportOptionalCall]
+            )
+    return None
+
+
+class VectorValidator:
+    """A validator of pure int arithmetic, evaluated on the whole vector of answers with int64 ufuncs."""
+
+    __slots__ = ("_node", "slots", "template")
+
+    def __init__(self, template: str, slots: tuple[str, ...], node: Node) -> None:
+        self.template: str = template
+        self.slots: tuple[str, ...] = slots
+        self._node: Node = node
+
+    def __call__(self, values: Mapping[str, int], x: Vector) -> Vector:
+        """Evaluate the validator on every value of `x`.
+
+        Returns:
+            Vector: The answers of the validator.
+
+        Raises:
+            VectorFallbackError: If the result might overflow int64, or python would raise an exception.
+
+        """
+        params = tuple(values[key] for key in self.slots)
+        if any(abs(param) >= LIMIT for param in params):
+            raise VectorFallbackError
+        result = self._node(x, params)
+        if isinstance(result, int):
+            _check(abs(result))
+            return np.full_like(x, result)
+        return result
+
+
+@cache
+def compile_vector_validator(template: str) -> VectorValidator | None:
+    """Recognize a validator template of pure int arithmetic from its AST.
+
+    Returns:
+        VectorValidator | None: The vector evaluation of the validator, `None` if it cannot be vectorized.
+
+    """
+    if (parametrized := parametrize(template)) is None:
+        return None
+    slots, source = parametrized
+    try:
+        body = ast.parse(source).body
+    except SyntaxError:
+        return None
+    match body:
+        case [
+            *imports,
+            ast.Assign(
+                targets=[ast.Name(id="validator")],
+                value=ast.Lambda(
+                    args=ast.arguments(
+                        posonlyargs=[],
+                        args=[ast.arg(arg=arg)],
+                        vararg=None,
+                        kwonlyargs=[],
+                        kwarg=None,
+                    ),
+                    body=expr,
+                ),
+            ),
+        ] if all(isinstance(stmt, ast.Import | ast.ImportFrom) for stmt in imports):
+            node = _build(expr, arg, {slot_name(i): i for i in range(len(slots))})
+            return None if node is None else VectorValidator(template, slots, node)
+    return None
+
+
+def to_vector(answers: Answers) -> Vector | None:
+    """Convert the answers to an int64 vector if every answer is a python int in the safe range.
+
+    Returns:
+        Vector | None: The vector of answers, `None` if it cannot be represented exactly.
+
+    """
+    if not isinstance(answers, list):
+        return answers
+    if not all(type(value) is int and -LIMIT < value < LIMIT for value in answers):
+        return None
+    return np.array(answers, dtype=np.int64)
+
+
+def to_list(answers: Answers) -> list[int]:
+    """Convert the answers back to a list of python int.
+
+    Returns:
+        list[int]: The answers.
+
+    """
+    if isinstance(answers, list):
+        return answers
+    return answers.tolist()
+
+
+def apply_validator(entry: Part, values: Mapping[str, int], answers: Answers) -> Answers:
+    """Apply the validator of `entry` to every answer, with int64 ufuncs when possible.
+
+    The vector path is only used for at least `VECTORIZE_MIN_TASKS` answers,
+    as numpy overhead outweigh the gain on short vectors.
+    Validators other than plain int arithmetic are looked up in `STEP_MEMO` first.
+
+    Returns:
+        Answers: The new answers, as a vector if it is evaluated with numpy.
+
+    """
+    vector_fn = compile_vector_validator(entry.validator)
+    if vector_fn is not None and 0 < VECTORIZE_MIN_TASKS <= len(answers):
+        vector = to_vector(answers)
+        if vector is not None:
+            try:
+                return vector_fn(values, vector)
+            except VectorFallbackError:
+                pass
+    factory = compile_validator(entry.validator)
+    fn = factory.bind(values)
+    # plain int arithmetic is cheaper than the lookup
+    if vector_fn is None:
+        fn = STEP_MEMO.wrap(factory, values, fn)
+    return list(map(fn, to_list(answers)))
@@ -1,6 +1,8 @@
+import asyncio
 from os import getenv
 from pathlib import Path
 
+import anyio.to_thread
 from advanced_alchemy.exceptions import DuplicateKeyError, NotFoundError, RepositoryError
 from crypto.key import export_all, generate_key_pair, import_all
 from litestar import Litestar
@@ -11,10 +13,27 @@ from litestar.logging import LoggingConfig
 from litestar.openapi import OpenAPIConfig
 from litestar.openapi.plugins import ScalarRenderPlugin
 from litestar.static_files import create_static_files_router
-from msgspec.json import decode, encode
+from msgspec.json import encode
 from server.captcha.controller.challenge import ChallengeController
-from server.captcha.lib.config import alchemy_plugin
+from server.captcha.controller.metrics import MetricsController
+from server.captcha.lib.config import (
+    QUESTION_POOL_EXECUTOR,
+    QUESTION_POOL_SIZE,
+    QUESTION_POOL_WORKERS,
+    QUESTION_SET_RELOAD_INTERVAL,
+    RENDER_EXECUTOR,
+    RENDER_QUEUE_SIZE,
+    RENDER_WORKERS,
+    alchemy_plugin,
+    sqlalchemy_config,
+)
+from server.captcha.lib.font import FONTS
+from server.captcha.lib.migrations import add_missing_columns
+from server.captcha.lib.pool import QuestionPool
+from server.captcha.lib.question_store import QuestionStore
+from server.captcha.lib.render import Renderer
 from server.captcha.lib.utils import exception_handler
+from server.captcha.models import Challenge
 from server.captcha.schema.questions import Question, QuestionSet
 
 CONFIG_PATH = Path(getenv("KEY_PATH", "./captcha_data"))
@@ -50,18 +69,81 @@ def ensure_questions(app: Litestar) -> None:  # noqa: D103
                     ),
                 ),
             )
-    with (CONFIG_PATH / "question_set.json").open("rb") as fp:
-        question_set = decode(fp.read(), type=QuestionSet)
-    app.state["question_set"] = question_set
+    store = QuestionStore(
+        CONFIG_PATH / "question_set.json",
+        archive=CONFIG_PATH / "question_sets",
+        table_directory=CONFIG_PATH / "number_theory",
+    )
+    # the tables are loaded by the warm-up once the server is up, so startup only parses the question set
+    store.load(table=False)
+    app.state["question_store"] = store
+
+
+async def migrate_database(_: Litestar) -> None:  # noqa: D103
+    # an existing database, such as on the docker volume, is not updated by `create_all`
+    async with sqlalchemy_config.get_engine().begin() as connection:
+        await connection.run_sync(add_missing_columns, Challenge.__table__)
+
+
+async def start_question_store(app: Litestar) -> None:  # noqa: D103
+    await app.state["question_store"].start(QUESTION_SET_RELOAD_INTERVAL)
+
+
+async def stop_question_store(app: Litestar) -> None:  # noqa: D103
+    await app.state["question_store"].stop()
+
+
+async def start_fonts(app: Litestar) -> None:  # noqa: D103
+    # resolved in the background, so the first render does not load the fallback chain
+    app.state["font_task"] = asyncio.create_task(anyio.to_thread.run_sync(FONTS.resolve), name="font-resolve")
+
+
+async def start_renderer(app: Litestar) -> None:  # noqa: D103
+    renderer = Renderer(
+        workers=RENDER_WORKERS,
+        queue_size=RENDER_QUEUE_SIZE,
+        executor="process" if RENDER_EXECUTOR == "process" else "thread",
+    )
+    await renderer.start()
+    app.state["renderer"] = renderer
+
+
+async def stop_renderer(app: Litestar) -> None:  # noqa: D103
+    await app.state["renderer"].stop()
+
+
+async def start_question_pool(app: Litestar) -> None:  # noqa: D103
+    pool = QuestionPool(
+        app.state["question_store"],
+        size=QUESTION_POOL_SIZE,
+        workers=QUESTION_POOL_WORKERS,
+        executor=QUESTION_POOL_EXECUTOR if QUESTION_POOL_EXECUTOR in {"process", "sandbox"} else "thread",
+    )
+    await pool.start()
+    app.state["question_pool"] = pool
+
+
+async def stop_question_pool(app: Litestar) -> None:  # noqa: D103
+    await app.state["question_pool"].stop()
 
 
 app = Litestar(
     debug=True,
     route_handlers=[
         ChallengeController,
+        MetricsController,
         create_static_files_router(path="/static", directories=["dist/frontend/captcha"], html_mode=True),
     ],
-    on_startup=[ensure_key, ensure_questions],
+    on_startup=[
+        ensure_key,
+        migrate_database,
+        ensure_questions,
+        start_question_store,
+        start_fonts,
+        start_renderer,
+        start_question_pool,
+    ],
+    on_shutdown=[stop_question_pool, stop_renderer, stop_question_store],
     plugins=[alchemy_plugin],
     openapi_config=OpenAPIConfig(
         title="Captcha API",
@@ -77,6 +159,7 @@ app = Litestar(
             404,
             405,
             429,
+            503,
             NotFoundError,
             DuplicateKeyError,
             ClientException,
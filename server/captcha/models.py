@@ -2,7 +2,7 @@ import json
 from uuid import UUID
 
 from advanced_alchemy.base import UUIDAuditBase
-from sqlalchemy.orm import Mapped
+from sqlalchemy.orm import Mapped, mapped_column
 
 
 class Challenge(UUIDAuditBase):
@@ -13,6 +13,8 @@ class Challenge(UUIDAuditBase):
     question: Mapped[str]
     tasks: Mapped[str]
     answers: Mapped[str]
+    # defaulted, for the challenges created before question sets were versioned
+    question_set_version: Mapped[int] = mapped_column(default=0, server_default="0")
 
     @property
     def task_list(self) -> list[int]:
@@ -1,19 +1,40 @@
+from typing import Annotated
 from uuid import UUID
 
-from msgspec import Struct
+from msgspec import Meta, Struct
+from server.captcha.lib.config import QUESTION_PARTS_MAX
 
 
-class GenerateChallengeRequest(Struct):  # noqa: D101
+class GenerateChallengeRequest(Struct):
+    """Generate a challenge, of `parts` parts or of the amount of parts of a `tier` if either is given."""
+
     website: str
     session_id: UUID
+    parts: Annotated[int, Meta(ge=0, le=QUESTION_PARTS_MAX)] | None = None
+    tier: str | None = None
 
 
 class GenerateChallengeResponse(Struct):  # noqa: D101
     challenge_id: UUID
 
 
-class GetChallengeResponse(Struct):  # noqa: D101
-    question: str
+class GenerateChallengesRequest(Struct):
+    """Generate `count` challenges for each website and session."""
+
+    challenges: list[GenerateChallengeRequest]
+    count: Annotated[int, Meta(ge=1)] = 1
+
+
+class GenerateChallengesResponse(Struct):
+    """The ID of the generated challenges, `count` in a row for each website and session in the request order."""
+
+    challenge_ids: list[UUID]
+
+
+class GetChallengeResponse(Struct):
+    """The tasks of a challenge, and the URL of its question image, a PNG at the requested width."""
+
+    image_url: str
     tasks: list[int]
 
 
@@ -0,0 +1,122 @@
+from msgspec import Struct
+
+
+class QuestionPoolStats(Struct):
+    """Statistic of the pre-generated question pool."""
+
+    size: int
+    depth: int
+    workers: int
+    executor: str
+    hits: int
+    misses: int
+    generated: int
+    refill_rate: float
+
+
+class ConstructStats(Struct):
+    """Statistic of the questions generated from one `construct`.
+
+    `collapse_rate` is the fraction of questions where a `part` collapsed the answers and was replaced,
+    and `collapsed` the amount of questions still collapsed after the redraws.
+    """
+
+    generated: int
+    collapse_rate: float
+    collapsed: int
+
+
+class GeneratorStats(Struct):
+    """Statistic of the question generator."""
+
+    generated: int
+    growth_guard: dict[str, int]
+    constructs: dict[str, ConstructStats]
+
+
+class StepMemoStats(Struct):
+    """Statistic of the memo of validator steps."""
+
+    budget: int
+    bytes: int
+    entries: int
+    hits: int
+    misses: int
+    evictions: int
+    hit_rate: float
+
+
+class FontStats(Struct):
+    """Statistic of the fonts of the rendered questions.
+
+    `path` is the font resolved from the fallback chain, `None` for Pillow's default font,
+    and `load_seconds` the total time spent loading fonts, including the candidates failing to load.
+    """
+
+    path: str | None
+    resolved: bool
+    sizes: int
+    loads: int
+    load_seconds: float
+    hits: int
+
+
+class RenderCacheStats(Struct):
+    """Statistic of the cache of rendered question images."""
+
+    budget: int
+    bytes: int
+    entries: int
+    hits: int
+    misses: int
+    evictions: int
+    expired: int
+    hit_rate: float
+
+
+class RenderQueueStats(Struct):
+    """Statistic of the render workers.
+
+    The timings are in seconds over the latest renders, `wait` is the time queued before a worker picked the render up
+    and `render` the time the worker took, and `rejected` the amount of renders turned away by a full queue.
+    """
+
+    executor: str
+    workers: int
+    queue_size: int
+    in_flight: int
+    rendered: int
+    rejected: int
+    wait_p50: float
+    wait_p99: float
+    render_p50: float
+    render_p99: float
+
+
+class PrerenderStats(Struct):
+    """Statistic of the images rendered in the background when a challenge is generated.
+
+    `skipped` are the prerenders not started as no worker was free. The first fetch of a prerendered image is a `hits`
+    if it was cached, a `waits` if the prerender was still running, otherwise a `misses`. `lag` is the seconds from
+    the creation of the challenge to the image being cached, over the latest prerenders.
+    """
+
+    width: int
+    scheduled: int
+    skipped: int
+    rendered: int
+    hits: int
+    waits: int
+    misses: int
+    hit_rate: float
+    lag_p50: float
+    lag_p99: float
+
+
+class RenderStats(Struct):
+    """Statistic of the rendering of the questions to images."""
+
+    font: FontStats
+    cache: RenderCacheStats
+    queue: RenderQueueStats
+    prerender: PrerenderStats
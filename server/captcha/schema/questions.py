@@ -1,14 +1,22 @@
-from msgspec import Struct
+from typing import Annotated
+
+from msgspec import Meta, Struct
 
 type Ranges = dict[str, tuple[int, int]]
 
 
-class Part(Struct):
-    """A part in question_set.json."""
+class Part(Struct, kw_only=True):
+    """A part in question_set.json.
+
+    `weight` is the relative probability of picking the entry, and `cost` the measured microseconds of one call of
+    the validator, such as the p99 reported by `server.captcha.bench.cost`, to keep questions within the cost budget.
+    """
 
     question: str
     validator: str
     range: Ranges
+    weight: Annotated[float, Meta(ge=0)] = 1.0
+    cost: float | None = None
 
 
 class Question(Part):
@@ -17,7 +25,7 @@ class Question(Part):
     input: tuple[int, int]
 
 
-class QuestionSet(Struct):
+class QuestionSet(Struct, weakref=True):
     """Schema for question_set.json."""
 
     construct: list[str]
@@ -32,6 +40,7 @@ class QuestionSection(Struct):
 
     question: str
     validator: str
+    values: dict[str, int] = {}
 
 
 class GeneratedQuestion(Struct):
@@ -40,3 +49,8 @@ class GeneratedQuestion(Struct):
     question: str
     tasks: list[int]
     solutions: list[int]
+    rejected_parts: list[str] = []
+    version: int = 0
+    construct: str = ""
+    collapses: int = 0
+    collapsed: bool = False